@@ -0,0 +1,366 @@
+"""Benchmark offline da API: sobe o `app` de src/main.py em processo, com Gemini, Vision
+e embeddings falsos, e mede latência (p50/p95/p99), vazão, atraso do event loop e
+velocidade de ingestão. O ChromaDB é o real, em um diretório temporário.
+
+Uso (a partir da raiz do repositório):
+
+    python -m bench.executar --duracao 30 --concorrencia 32
+    python -m bench.executar --gemini 2.0,0.5,0.02 --mix rag_query=1 --json resultado.json
+
+Os limites do agendador (GEMINI_RPM, VISION_RPM, ...) continuam valendo; para medir só
+a API, aumente-os pelas variáveis de ambiente.
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from collections import defaultdict
+
+# O benchmark nunca fala com os serviços reais nem grava nos diretórios da aplicação
+_DIRETORIO = tempfile.mkdtemp(prefix="bench_")
+os.environ.setdefault("CHROMA_PERSIST_DIR", os.path.join(_DIRETORIO, "chroma"))
+os.environ.setdefault("TEMP_UPLOAD_DIR", os.path.join(_DIRETORIO, "uploads"))
+os.environ.setdefault("LOTES_DB_PATH", os.path.join(_DIRETORIO, "lotes.sqlite3"))
+os.environ.pop("CORRECAO_CACHE_DIR", None)
+
+import httpx
+from src import main, recursos
+from .falsos import PerfilLatencia, GeminiFalso, VisionFalso, EmbeddingsFalsos, ChatFalso
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+COLECAO = "benchmark"
+GENEROS = ["Dissertação", "Conto", "Crônica", "Carta Aberta"]
+PALAVRAS = (
+    "educação sociedade tecnologia desigualdade acesso escola cidadania cultura leitura "
+    "desafio política ambiente ciência mitose meiose célula energia função derivada "
+    "integral limite vetor matriz história economia saúde trabalho juventude democracia"
+).split()
+
+
+# --- Geração de Entradas ---
+def _texto(rng: random.Random, palavras: int) -> str:
+    return " ".join(rng.choice(PALAVRAS) for _ in range(palavras)).capitalize() + "."
+
+
+def gerar_pdf(paginas: int, linhas_por_pagina: int = 40, semente: int = 0) -> bytes:
+    """PDF mínimo com texto em Helvetica, sem dependências externas."""
+    rng = random.Random(semente)
+    objetos = ["<< /Type /Catalog /Pages 2 0 R >>"]
+    filhos = " ".join(f"{3 + 2 * i} 0 R" for i in range(paginas))
+    objetos.append(f"<< /Type /Pages /Kids [{filhos}] /Count {paginas} >>")
+    fonte = 3 + 2 * paginas
+    for i in range(paginas):
+        objetos.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R "
+            f"/Resources << /Font << /F1 {fonte} 0 R >> >> >>"
+        )
+        linhas = "".join(f"({_texto(rng, 12)}) Tj 0 -14 Td " for _ in range(linhas_por_pagina))
+        conteudo = f"BT /F1 10 Tf 20 770 Td {linhas} ET"
+        objetos.append(f"<< /Length {len(conteudo.encode('latin-1', 'replace'))} >>\nstream\n{conteudo}\nendstream")
+    objetos.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    saida = "%PDF-1.4\n"
+    posicoes = []
+    for i, objeto in enumerate(objetos):
+        posicoes.append(len(saida.encode("latin-1", "replace")))
+        saida += f"{i + 1} 0 obj\n{objeto}\nendobj\n"
+    xref = len(saida.encode("latin-1", "replace"))
+    saida += f"xref\n0 {len(objetos) + 1}\n0000000000 65535 f \n"
+    saida += "".join(f"{p:010d} 00000 n \n" for p in posicoes)
+    saida += f"trailer << /Size {len(objetos) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF"
+    return saida.encode("latin-1", "replace")
+
+
+def gerar_foto(lado: int) -> bytes:
+    """Foto JPEG com ruído, no tamanho de uma foto de celular, para exercitar o pré-processamento."""
+    if Image is None:
+        return os.urandom(lado * lado // 8)
+    imagem = Image.effect_noise((lado * 3 // 4, lado), 64).convert("RGB")
+    saida = io.BytesIO()
+    imagem.save(saida, format="JPEG", quality=90)
+    return saida.getvalue()
+
+
+class Entradas:
+    """Sorteia entradas novas ou repetidas (estas exercitam os caches) na proporção pedida."""
+
+    def __init__(self, repeticao: float, foto: bytes, semente: int = 0):
+        self.repeticao = repeticao
+        self.foto = foto
+        self.rng = random.Random(semente)
+        self._vistas = defaultdict(list)
+        self._contador = 0
+
+    def _escolher(self, tipo: str, gerar):
+        vistas = self._vistas[tipo]
+        if vistas and self.rng.random() < self.repeticao:
+            return self.rng.choice(vistas)
+        valor = gerar()
+        vistas.append(valor)
+        return valor
+
+    def redacao(self) -> str:
+        return self._escolher("redacao", lambda: _texto(self.rng, 350))
+
+    def pergunta(self) -> str:
+        return self._escolher("pergunta", lambda: f"Explique {_texto(self.rng, 6).lower()}")
+
+    def foto_unica(self) -> bytes:
+        # Bytes extras após o fim do JPEG mudam o hash sem impedir a leitura da imagem
+        def gerar():
+            self._contador += 1
+            return self.foto + f"bench-{self._contador}".encode()
+        return self._escolher("foto", gerar)
+
+
+# --- Cenários de Tráfego ---
+async def _consumir_sse(cliente: httpx.AsyncClient, url: str, **kwargs) -> int:
+    async with cliente.stream("POST", url, **kwargs) as resposta:
+        async for linha in resposta.aiter_lines():
+            if linha.startswith("event: erro"):
+                return 599
+        return resposta.status_code
+
+
+async def redacao_texto(cliente, entradas):
+    if random.random() < 0.5:
+        r = await cliente.post("/redacao/corrigir-texto-enem/", json={"texto": entradas.redacao()})
+    else:
+        r = await cliente.post("/redacao/corrigir-texto-ufsc/", json={"texto": entradas.redacao(), "genero": random.choice(GENEROS)})
+    return r.status_code
+
+
+async def redacao_imagem(cliente, entradas):
+    arquivos = {"foto": ("redacao.jpg", entradas.foto_unica(), "image/jpeg")}
+    r = await cliente.post("/redacao/corrigir-redacao-enem/", files=arquivos)
+    return r.status_code
+
+
+async def redacao_stream(cliente, entradas):
+    return await _consumir_sse(cliente, "/redacao/corrigir-texto-enem/stream", json={"texto": entradas.redacao()})
+
+
+async def rag_query(cliente, entradas):
+    r = await cliente.post("/rag/query", json={"question": entradas.pergunta(), "colecao": COLECAO})
+    return r.status_code
+
+
+async def rag_stream(cliente, entradas):
+    return await _consumir_sse(cliente, "/rag/query/stream", json={"question": entradas.pergunta(), "colecao": COLECAO})
+
+
+CENARIOS = {
+    "redacao_texto": redacao_texto,
+    "redacao_imagem": redacao_imagem,
+    "redacao_stream": redacao_stream,
+    "rag_query": rag_query,
+    "rag_stream": rag_stream,
+}
+MIX_PADRAO = "redacao_texto=3,redacao_imagem=1,redacao_stream=1,rag_query=4,rag_stream=1"
+
+
+# --- Medições ---
+def percentil(valores: list[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados)) - 1))]
+
+
+def resumir(valores: list[float]) -> dict:
+    return {
+        "p50_ms": round(percentil(valores, 50) * 1000, 1),
+        "p95_ms": round(percentil(valores, 95) * 1000, 1),
+        "p99_ms": round(percentil(valores, 99) * 1000, 1),
+        "max_ms": round(max(valores, default=0) * 1000, 1),
+    }
+
+
+async def medir_atraso_loop(atrasos: list[float], parar: asyncio.Event, intervalo: float = 0.01):
+    """Agenda um despertar a cada `intervalo` e registra quanto ele chegou atrasado:
+    qualquer trabalho bloqueante no event loop aparece aqui."""
+    while not parar.is_set():
+        inicio = time.perf_counter()
+        await asyncio.sleep(intervalo)
+        atrasos.append(max(0.0, time.perf_counter() - inicio - intervalo))
+
+
+async def aguardar_pronta(cliente: httpx.AsyncClient, limite: float = 60) -> float:
+    """Espera /health/ready responder 200 e retorna quanto tempo levou."""
+    inicio = time.perf_counter()
+    while (await cliente.get("/health/ready")).status_code != 200:
+        if time.perf_counter() - inicio > limite:
+            raise RuntimeError("A API não ficou pronta: " + (await cliente.get("/health/ready")).text)
+        await asyncio.sleep(0.05)
+    return time.perf_counter() - inicio
+
+
+async def ingerir(cliente: httpx.AsyncClient, paginas: int) -> dict:
+    pdf = gerar_pdf(paginas)
+    inicio = time.perf_counter()
+    r = await cliente.post(
+        "/rag/upload", data={"colecao": COLECAO}, files={"file": ("benchmark.pdf", pdf, "application/pdf")}
+    )
+    r.raise_for_status()
+    job_id = r.json()["job_id"]
+    while True:
+        job = (await cliente.get(f"/rag/ingestoes/{job_id}")).json()
+        if job["status"] not in ("pendente", "processando"):
+            break
+        await asyncio.sleep(0.05)
+    duracao = time.perf_counter() - inicio
+    return {
+        "status": job["status"],
+        "erro": job["erro"],
+        "paginas": job["paginas_total"],
+        "chunks": job["chunks_total"],
+        "segundos": round(duracao, 2),
+        "paginas_por_segundo": round((job["paginas_total"] or 0) / duracao, 1),
+    }
+
+
+async def gerar_carga(cliente, mix: dict[str, float], entradas: Entradas, concorrencia: int, duracao: float) -> dict:
+    latencias = defaultdict(list)
+    status = defaultdict(lambda: defaultdict(int))
+    nomes, pesos = zip(*mix.items())
+    fim = time.perf_counter() + duracao
+
+    async def usuario():
+        while time.perf_counter() < fim:
+            nome = random.choices(nomes, pesos)[0]
+            inicio = time.perf_counter()
+            try:
+                codigo = await CENARIOS[nome](cliente, entradas)
+            except Exception:
+                codigo = 0
+            latencias[nome].append(time.perf_counter() - inicio)
+            status[nome][codigo] += 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(usuario() for _ in range(concorrencia)))
+    decorrido = time.perf_counter() - inicio
+
+    cenarios = {}
+    for nome in nomes:
+        total = len(latencias[nome])
+        erros = sum(n for codigo, n in status[nome].items() if not 200 <= codigo < 300)
+        cenarios[nome] = {"requisicoes": total, "erros": erros, "status": dict(status[nome]), **resumir(latencias[nome])}
+    todas = [v for valores in latencias.values() for v in valores]
+    return {
+        "segundos": round(decorrido, 2),
+        "requisicoes": len(todas),
+        "rps": round(len(todas) / decorrido, 1),
+        "latencia": resumir(todas),
+        "cenarios": cenarios,
+    }
+
+
+# --- Execução ---
+def _perfil(texto: str, padrao: str) -> PerfilLatencia:
+    valores = [float(v) for v in (texto or padrao).split(",")]
+    valores += [0.0] * (3 - len(valores))
+    media, jitter, taxa_erro = valores[:3]
+    return PerfilLatencia(media=media, jitter=jitter, taxa_erro=taxa_erro)
+
+
+def _mix(texto: str) -> dict[str, float]:
+    mix = {}
+    for parte in texto.split(","):
+        nome, _, peso = parte.partition("=")
+        if nome not in CENARIOS:
+            raise SystemExit(f"Cenário desconhecido: {nome}. Opções: {', '.join(CENARIOS)}")
+        mix[nome] = float(peso or 1)
+    return mix
+
+
+def instalar_falsos(args) -> dict:
+    """Registra os serviços falsos no lugar dos reais no registro de recursos."""
+    falsos = {
+        "gemini": GeminiFalso(_perfil(args.gemini, "1.5,0.3")),
+        "vision": VisionFalso(_perfil(args.vision, "0.4,0.1")),
+        "embeddings": EmbeddingsFalsos(_perfil(args.embeddings, "0.15,0.03")),
+        "rag_llm": ChatFalso(perfil=_perfil(args.gemini, "1.5,0.3")),
+    }
+    recursos.registrar("gemini_correcao", lambda: falsos["gemini"])
+    recursos.registrar("vision_client", lambda: falsos["vision"])
+    recursos.registrar("rag_embeddings", lambda: falsos["embeddings"])
+    recursos.registrar("rag_llm", lambda: falsos["rag_llm"])
+    return falsos
+
+
+def imprimir(resultado: dict):
+    ingestao = resultado["ingestao"]
+    print(f"\nPronta para tráfego em {resultado['segundos_ate_pronta']}s")
+    print(f"Ingestão: {ingestao['paginas']} páginas, {ingestao['chunks']} chunks em {ingestao['segundos']}s "
+          f"({ingestao['paginas_por_segundo']} páginas/s, status {ingestao['status']})")
+    carga = resultado["carga"]
+    print(f"Carga: {carga['requisicoes']} requisições em {carga['segundos']}s ({carga['rps']} req/s)\n")
+    print(f"{'cenário':<16}{'req':>7}{'erros':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    linhas = list(carga["cenarios"].items()) + [("total", {**carga["latencia"], "requisicoes": carga["requisicoes"], "erros": sum(c["erros"] for c in carga["cenarios"].values())})]
+    for nome, c in linhas:
+        print(f"{nome:<16}{c['requisicoes']:>7}{c['erros']:>7}{c['p50_ms']:>10}{c['p95_ms']:>10}{c['p99_ms']:>10}{c['max_ms']:>10}")
+    atraso = resultado["atraso_event_loop"]
+    print(f"\nAtraso do event loop: p50 {atraso['p50_ms']} ms, p99 {atraso['p99_ms']} ms, máx {atraso['max_ms']} ms")
+    print("Chamadas aos serviços falsos:", resultado["chamadas_upstream"])
+
+
+async def executar(args) -> dict:
+    random.seed(args.semente)
+    falsos = instalar_falsos(args)
+    entradas = Entradas(args.repeticao, gerar_foto(args.lado_foto), args.semente)
+    atrasos: list[float] = []
+    parar = asyncio.Event()
+
+    async with main.app.router.lifespan_context(main.app):
+        transporte = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://bench", timeout=None) as cliente:
+            prontidao = await aguardar_pronta(cliente)
+            medidor = asyncio.create_task(medir_atraso_loop(atrasos, parar))
+            resultado_ingestao = await ingerir(cliente, args.paginas)
+            resultado_carga = await gerar_carga(cliente, _mix(args.mix), entradas, args.concorrencia, args.duracao)
+            parar.set()
+            await medidor
+
+    return {
+        "parametros": vars(args),
+        "segundos_ate_pronta": round(prontidao, 2),
+        "ingestao": resultado_ingestao,
+        "carga": resultado_carga,
+        "atraso_event_loop": resumir(atrasos),
+        "chamadas_upstream": {nome: falso.chamadas for nome, falso in falsos.items() if hasattr(falso, "chamadas")},
+    }
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline da API com serviços externos falsos.")
+    parser.add_argument("--duracao", type=float, default=20, help="segundos de geração de carga")
+    parser.add_argument("--concorrencia", type=int, default=16, help="usuários simultâneos")
+    parser.add_argument("--mix", default=MIX_PADRAO, help="pesos dos cenários, ex.: rag_query=3,redacao_texto=1")
+    parser.add_argument("--repeticao", type=float, default=0.2, help="fração de entradas repetidas (acertos de cache)")
+    parser.add_argument("--paginas", type=int, default=100, help="páginas do PDF ingerido antes da carga")
+    parser.add_argument("--lado-foto", type=int, default=2400, help="maior lado, em pixels, das fotos de redação")
+    parser.add_argument("--gemini", help="latência do Gemini: media[,jitter[,taxa_erro]] em segundos (padrão 1.5,0.3)")
+    parser.add_argument("--vision", help="latência do Vision (padrão 0.4,0.1)")
+    parser.add_argument("--embeddings", help="latência dos embeddings (padrão 0.15,0.03)")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--json", help="grava o resultado completo neste arquivo")
+    args = parser.parse_args(argv)
+
+    resultado = asyncio.run(executar(args))
+    imprimir(resultado)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,145 @@
+import json
+import time
+import random
+import hashlib
+from dataclasses import dataclass
+from types import SimpleNamespace
+import numpy as np
+from google.api_core import exceptions as google_exceptions
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# --- Serviços Externos Falsos ---
+# Substitutos locais do Gemini, do Vision e dos embeddings para o benchmark. As respostas
+# são determinísticas (derivadas do hash da entrada) e a latência, o jitter e a taxa de
+# erros de cada serviço são configuráveis. Os erros usam as mesmas exceções do
+# google-api-core que os SDKs reais lançam, então o agendador trata ambos igualmente.
+
+
+@dataclass
+class PerfilLatencia:
+    media: float = 0.5
+    jitter: float = 0.1
+    taxa_erro: float = 0.0
+    # Tempo entre trechos nas respostas em streaming
+    intervalo_stream: float = 0.02
+
+    def esperar(self):
+        time.sleep(max(0.0, random.gauss(self.media, self.jitter)))
+        if self.taxa_erro and random.random() < self.taxa_erro:
+            erro = random.choice([google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable])
+            raise erro("erro simulado pelo benchmark")
+
+
+def _semente(texto: str) -> int:
+    return int.from_bytes(hashlib.sha256(texto.encode("utf-8")).digest()[:8], "big")
+
+
+def _fatiar(texto: str, tamanho: int = 40) -> list[str]:
+    return [texto[i:i + tamanho] for i in range(0, len(texto), tamanho)]
+
+
+# --- Gemini (correção de redações) ---
+def correcao_falsa(prompt: str) -> dict:
+    """Relatório no formato pedido pelo prompt (UFSC ou ENEM), com notas derivadas do texto."""
+    rng = random.Random(_semente(prompt))
+    if "Coperve" in prompt:
+        notas = [round(rng.uniform(0, 2.5), 2) for _ in range(4)]
+        itens = [{"id": i + 1, "nome": f"Critério {i + 1}", "nota": n, "feedback": f"Feedback do critério {i + 1}."} for i, n in enumerate(notas)]
+        chave = "criterios"
+    else:
+        notas = [rng.choice(range(0, 201, 40)) for _ in range(5)]
+        itens = [{"id": i + 1, "nota": n, "feedback": f"Feedback da competência {i + 1}."} for i, n in enumerate(notas)]
+        chave = "competencias"
+    return {"nota_final": round(sum(notas), 2), "analise_geral": "Análise gerada pelo benchmark.", chave: itens}
+
+
+class GeminiFalso:
+    """Imita `genai.GenerativeModel.generate_content`, com e sem streaming."""
+
+    def __init__(self, perfil: PerfilLatencia):
+        self.perfil = perfil
+        self.chamadas = 0
+
+    def generate_content(self, prompt: str, stream: bool = False):
+        self.chamadas += 1
+        self.perfil.esperar()
+        texto = json.dumps(correcao_falsa(prompt), ensure_ascii=False)
+        if not stream:
+            return SimpleNamespace(text=texto)
+        return self._stream(texto)
+
+    def _stream(self, texto: str):
+        for trecho in _fatiar(texto):
+            time.sleep(self.perfil.intervalo_stream)
+            yield SimpleNamespace(text=trecho)
+
+
+# --- Vision (OCR) ---
+class VisionFalso:
+    """Imita `ImageAnnotatorClient.document_text_detection` devolvendo um texto derivado da imagem."""
+
+    def __init__(self, perfil: PerfilLatencia):
+        self.perfil = perfil
+        self.chamadas = 0
+
+    def document_text_detection(self, image):
+        self.chamadas += 1
+        self.perfil.esperar()
+        semente = hashlib.sha256(image.content).hexdigest()[:12]
+        texto = f"Redação extraída da imagem {semente}. " * 40
+        return SimpleNamespace(
+            error=SimpleNamespace(message=""),
+            full_text_annotation=SimpleNamespace(text=texto),
+        )
+
+
+# --- Embeddings ---
+class EmbeddingsFalsos(Embeddings):
+    """Vetores unitários pseudoaleatórios determinísticos a partir do hash do texto."""
+
+    def __init__(self, perfil: PerfilLatencia, dimensao: int = 768):
+        self.perfil = perfil
+        self.dimensao = dimensao
+        self.chamadas = 0
+
+    def _vetor(self, texto: str) -> list[float]:
+        vetor = np.random.default_rng(_semente(texto)).standard_normal(self.dimensao)
+        return (vetor / np.linalg.norm(vetor)).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.chamadas += 1
+        self.perfil.esperar()
+        return [self._vetor(texto) for texto in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        self.chamadas += 1
+        self.perfil.esperar()
+        return self._vetor(text)
+
+
+# --- Gemini (tutor do RAG) ---
+class ChatFalso(BaseChatModel):
+    """Modelo de chat do LangChain que responde com um HTML fixo derivado da pergunta."""
+
+    perfil: PerfilLatencia
+
+    @property
+    def _llm_type(self) -> str:
+        return "falso-benchmark"
+
+    def _resposta(self, messages) -> str:
+        semente = hashlib.sha256(str(messages[-1].content).encode("utf-8")).hexdigest()[:12]
+        return f"<div><h3>Resposta {semente}</h3><p>{'Explicação gerada pelo benchmark. ' * 20}</p></div>"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        self.perfil.esperar()
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._resposta(messages)))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        self.perfil.esperar()
+        for trecho in _fatiar(self._resposta(messages)):
+            time.sleep(self.perfil.intervalo_stream)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=trecho))
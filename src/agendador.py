@@ -0,0 +1,272 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import functools
+from . import execucao, metricas
+
+# --- Agendador de Chamadas aos Serviços Externos ---
+# Toda chamada ao Gemini, ao Vision e aos embeddings passa por aqui. Cada serviço tem um
+# balde de tokens (limite de requisições por minuto, com rajada) e uma fila com
+# prioridades: correções e perguntas feitas pelo usuário passam na frente dos lotes e da
+# ingestão de documentos. Erros temporários (cota esgotada, serviço indisponível) são
+# repetidos com backoff exponencial e jitter, e chamadas idênticas simultâneas
+# (mesma `chave`) compartilham uma única requisição ao serviço.
+
+PRIORIDADE_INTERATIVA = 0
+PRIORIDADE_LOTE = 1
+PRIORIDADE_INGESTAO = 2
+
+# Requisições por minuto e tamanho da rajada de cada serviço
+LIMITES_TAXA = {
+    "gemini": (
+        float(os.environ.get("GEMINI_RPM", "150")),
+        int(os.environ.get("GEMINI_RAJADA", "10")),
+    ),
+    "vision": (
+        float(os.environ.get("VISION_RPM", "1800")),
+        int(os.environ.get("VISION_RAJADA", "30")),
+    ),
+    "embeddings": (
+        float(os.environ.get("EMBEDDINGS_RPM", "1500")),
+        int(os.environ.get("EMBEDDINGS_RAJADA", "20")),
+    ),
+}
+
+AGENDADOR_MAX_TENTATIVAS = int(os.environ.get("AGENDADOR_MAX_TENTATIVAS", "4"))
+AGENDADOR_BACKOFF_BASE = float(os.environ.get("AGENDADOR_BACKOFF_BASE", "1.0"))
+AGENDADOR_BACKOFF_MAX = float(os.environ.get("AGENDADOR_BACKOFF_MAX", "30"))
+# Tempo máximo que uma chamada espera na fila antes de ser recusada com 503
+AGENDADOR_ESPERA_MAXIMA = float(os.environ.get("AGENDADOR_ESPERA_MAXIMA", "120"))
+
+_STATUS_COTA = 429
+_STATUS_RETENTAVEIS = {429, 500, 502, 503, 504}
+
+
+class ErroUpstream(Exception):
+    """Serviço externo sem capacidade no momento (cota esgotada ou indisponível, mesmo
+    após as novas tentativas). `status_code` é 429 ou 503 e `retry_after` sugere, em
+    segundos, quando o cliente pode tentar de novo."""
+
+    def __init__(self, upstream: str, status_code: int, retry_after: int, mensagem: str):
+        super().__init__(mensagem)
+        self.upstream = upstream
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+@functools.cache
+def _excecoes_google():
+    """Exceções do google-api-core (dependência dos SDKs do Gemini e do Vision), importadas
+    só quando algum erro precisa ser classificado; sem elas vale o código exposto pela exceção."""
+    try:
+        from google.api_core import exceptions
+    except ImportError:
+        return None
+    return exceptions
+
+
+def _status_do_erro(erro: BaseException) -> int | None:
+    """Código HTTP equivalente ao erro (ou a alguma de suas causas), se for um erro de serviço."""
+    google_exceptions = _excecoes_google()
+    while erro is not None:
+        if google_exceptions is not None:
+            if isinstance(erro, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)):
+                return 429
+            if isinstance(erro, google_exceptions.DeadlineExceeded):
+                return 504
+            if isinstance(erro, google_exceptions.GoogleAPICallError) and isinstance(erro.code, int):
+                return erro.code
+        status = getattr(erro, "status_code", None)
+        if isinstance(status, int):
+            return status
+        erro = erro.__cause__ or erro.__context__
+    return None
+
+
+def _backoff(tentativa: int) -> float:
+    """Backoff exponencial com "full jitter": espalha as novas tentativas dos clientes
+    para que não voltem todas ao mesmo tempo."""
+    return random.uniform(0, min(AGENDADOR_BACKOFF_MAX, AGENDADOR_BACKOFF_BASE * 2 ** tentativa))
+
+
+class FilaUpstream:
+    """Balde de tokens com fila de prioridade e limite de chamadas simultâneas."""
+
+    def __init__(self, nome: str, requisicoes_por_minuto: float, rajada: int, max_concorrencia: int):
+        self.nome = nome
+        self.taxa = requisicoes_por_minuto / 60
+        self.rajada = rajada
+        self.max_concorrencia = max_concorrencia
+        self.tokens = float(rajada)
+        self.em_uso = 0
+        self.pausado_ate = 0.0
+        self._atualizado_em = time.monotonic()
+        self._espera: list[tuple[int, int, asyncio.Future]] = []
+        self._sequencia = itertools.count()
+        self._timer: asyncio.TimerHandle | None = None
+
+    def _repor(self, agora: float):
+        self.tokens = min(self.rajada, self.tokens + (agora - self._atualizado_em) * self.taxa)
+        self._atualizado_em = agora
+
+    def _despachar(self):
+        agora = time.monotonic()
+        self._repor(agora)
+        while self._espera and self.em_uso < self.max_concorrencia:
+            _, _, futuro = self._espera[0]
+            if futuro.done():
+                heapq.heappop(self._espera)
+                continue
+            if agora < self.pausado_ate or self.tokens < 1:
+                atraso = max(self.pausado_ate - agora, (1 - self.tokens) / self.taxa)
+                if self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later(atraso, self._ao_repor)
+                return
+            heapq.heappop(self._espera)
+            self.tokens -= 1
+            self.em_uso += 1
+            futuro.set_result(None)
+
+    def _ao_repor(self):
+        self._timer = None
+        self._despachar()
+
+    async def adquirir(self, prioridade: int):
+        """Espera a vez na fila; quem chama deve chamar `liberar` ao terminar."""
+        futuro = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._espera, (prioridade, next(self._sequencia), futuro))
+        self._despachar()
+        try:
+            await asyncio.wait_for(futuro, AGENDADOR_ESPERA_MAXIMA)
+        except asyncio.TimeoutError:
+            raise ErroUpstream(
+                self.nome, 503, int(AGENDADOR_BACKOFF_MAX),
+                f"Fila do serviço '{self.nome}' cheia; tente novamente em instantes.",
+            )
+        except asyncio.CancelledError:
+            # A vaga pode ter sido concedida no mesmo instante do cancelamento
+            if futuro.done() and not futuro.cancelled():
+                self.liberar()
+            raise
+
+    def liberar(self):
+        self.em_uso -= 1
+        self._despachar()
+
+    def pausar(self, segundos: float):
+        """Segura toda a fila após um erro de cota, em vez de insistir com o serviço."""
+        self.pausado_ate = max(self.pausado_ate, time.monotonic() + segundos)
+        self.tokens = min(self.tokens, 0)
+
+
+_filas: dict[str, FilaUpstream] = {}
+_em_voo: dict[str, asyncio.Future] = {}
+
+
+def _obter_fila(upstream: str) -> FilaUpstream:
+    fila = _filas.get(upstream)
+    if fila is None:
+        requisicoes_por_minuto, rajada = LIMITES_TAXA[upstream]
+        fila = FilaUpstream(upstream, requisicoes_por_minuto, rajada, execucao.LIMITES_CONCORRENCIA[upstream])
+        _filas[upstream] = fila
+    return fila
+
+
+def _tratar_falha(fila: FilaUpstream, erro: Exception, tentativa: int) -> float:
+    """Decide se a chamada que falhou deve ser repetida e retorna a espera até a próxima
+    tentativa. Erros não temporários são relançados como estão; ao esgotar as tentativas,
+    o erro vira `ErroUpstream`."""
+    status = _status_do_erro(erro)
+    if status not in _STATUS_RETENTAVEIS:
+        raise erro
+    espera = _backoff(tentativa)
+    if status == _STATUS_COTA:
+        fila.pausar(espera)
+    if tentativa + 1 >= AGENDADOR_MAX_TENTATIVAS:
+        status_code = 429 if status == _STATUS_COTA else 503
+        motivo = "com cota esgotada" if status_code == 429 else "indisponível"
+        raise ErroUpstream(
+            fila.nome, status_code, max(1, round(AGENDADOR_BACKOFF_MAX)),
+            f"Serviço '{fila.nome}' {motivo} no momento; tente novamente em instantes.",
+        ) from erro
+    return espera
+
+
+async def _adquirir_medindo(fila: FilaUpstream, prioridade: int):
+    inicio = time.perf_counter()
+    await fila.adquirir(prioridade)
+    metricas.UPSTREAM_ESPERA.observar(time.perf_counter() - inicio, upstream=fila.nome, prioridade=prioridade)
+
+
+def _registrar_falha(fila: FilaUpstream, erro: Exception, tentativa: int) -> float:
+    """`_tratar_falha` contabilizando a falha como retentativa ou erro definitivo."""
+    try:
+        espera = _tratar_falha(fila, erro, tentativa)
+    except Exception:
+        metricas.UPSTREAM_CHAMADAS.inc(upstream=fila.nome, resultado="erro")
+        raise
+    metricas.UPSTREAM_CHAMADAS.inc(upstream=fila.nome, resultado="retentativa")
+    return espera
+
+
+async def _chamar_com_tentativas(upstream: str, prioridade: int, func, args, kwargs):
+    fila = _obter_fila(upstream)
+    for tentativa in range(AGENDADOR_MAX_TENTATIVAS):
+        await _adquirir_medindo(fila, prioridade)
+        inicio = time.perf_counter()
+        try:
+            resultado = await execucao.executar(upstream, func, *args, **kwargs)
+            metricas.UPSTREAM_CHAMADAS.inc(upstream=upstream, resultado="sucesso")
+            return resultado
+        except Exception as e:
+            espera = _registrar_falha(fila, e, tentativa)
+        finally:
+            fila.liberar()
+            metricas.UPSTREAM_DURACAO.observar(time.perf_counter() - inicio, upstream=upstream)
+        await asyncio.sleep(espera)
+
+
+async def chamar(upstream: str, func, *args, prioridade: int = PRIORIDADE_INTERATIVA, chave: str | None = None, **kwargs):
+    """Executa `func` no pool do serviço respeitando o limite de taxa e a prioridade.
+    Chamadas simultâneas com a mesma `chave` compartilham o mesmo resultado."""
+    if chave is None:
+        return await _chamar_com_tentativas(upstream, prioridade, func, args, kwargs)
+
+    chave = f"{upstream}:{chave}"
+    tarefa = _em_voo.get(chave)
+    if tarefa is None:
+        tarefa = asyncio.ensure_future(_chamar_com_tentativas(upstream, prioridade, func, args, kwargs))
+        _em_voo[chave] = tarefa
+        tarefa.add_done_callback(lambda _: _em_voo.pop(chave, None))
+    else:
+        metricas.UPSTREAM_CHAMADAS.inc(upstream=upstream, resultado="coalescida")
+    # shield: se um dos clientes desconectar, a chamada continua para os demais
+    return await asyncio.shield(tarefa)
+
+
+async def iterar(upstream: str, func, *args, prioridade: int = PRIORIDADE_INTERATIVA, **kwargs):
+    """Versão de `execucao.iterar` com limite de taxa e prioridade. A vaga fica ocupada
+    até o fim do streaming; só há nova tentativa se o erro ocorrer antes do primeiro item."""
+    fila = _obter_fila(upstream)
+    for tentativa in range(AGENDADOR_MAX_TENTATIVAS):
+        await _adquirir_medindo(fila, prioridade)
+        inicio = time.perf_counter()
+        produziu = False
+        try:
+            async for item in execucao.iterar(upstream, func, *args, **kwargs):
+                produziu = True
+                yield item
+            metricas.UPSTREAM_CHAMADAS.inc(upstream=upstream, resultado="sucesso")
+            return
+        except Exception as e:
+            if produziu:
+                metricas.UPSTREAM_CHAMADAS.inc(upstream=upstream, resultado="erro")
+                raise
+            espera = _registrar_falha(fila, e, tentativa)
+        finally:
+            fila.liberar()
+            metricas.UPSTREAM_DURACAO.observar(time.perf_counter() - inicio, upstream=upstream)
+        await asyncio.sleep(espera)
@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from . import metricas
+from .execucao import executar
+
+# --- Cache LRU em Memória com Camada Opcional em Disco ---
+# Usado para guardar resultados caros (correções do Gemini, OCR do Vision) indexados
+# por um hash do conteúdo. A camada em memória é um LRU com TTL; a camada em disco
+# (SQLite) é opcional e sobrevive a reinicializações da API. Em código assíncrono use
+# `aget`/`aset`, que fazem o acesso ao SQLite no pool de threads "cache".
+
+CACHE_ACESSOS_POR_GRAVACAO = int(os.environ.get("CACHE_ACESSOS_POR_GRAVACAO", "256"))
+
+
+class CacheLRU:
+    def __init__(self, nome: str, max_itens: int = 1024, ttl_segundos: float | None = None,
+                 diretorio_disco: str | None = None, max_itens_disco: int = 100_000):
+        self.nome = nome
+        self.max_itens = max_itens
+        self.ttl_segundos = ttl_segundos
+        self.max_itens_disco = max_itens_disco
+        self._itens: OrderedDict[str, tuple[float | None, object]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits_memoria = 0
+        self.hits_disco = 0
+        self.misses = 0
+        metricas.registrar_cache(self)
+
+        # Acessos a itens do disco ainda não gravados: o horário de acesso (usado só para
+        # escolher o que podar) é gravado em lote, não a cada acerto
+        self._acessos_pendentes: dict[str, float] = {}
+        # Estimativa (limite superior) de linhas no disco, para não contar a tabela a cada escrita
+        self._total_disco = 0
+        # O arquivo do SQLite só é criado no primeiro acesso ao disco, não ao importar o módulo
+        self._caminho_db = os.path.join(diretorio_disco, f"{nome}.sqlite3") if diretorio_disco else None
+        self._conexao = None
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        """Conexão com a camada em disco, aberta no primeiro uso (sempre sob `self._lock`)."""
+        if self._conexao is None:
+            os.makedirs(os.path.dirname(self._caminho_db), exist_ok=True)
+            conexao = sqlite3.connect(self._caminho_db, check_same_thread=False)
+            conexao.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " chave TEXT PRIMARY KEY, valor TEXT NOT NULL, expira_em REAL, acessado_em REAL NOT NULL)"
+            )
+            conexao.commit()
+            (self._total_disco,) = conexao.execute("SELECT COUNT(*) FROM cache").fetchone()
+            self._conexao = conexao
+        return self._conexao
+
+    def _expira_em(self):
+        return time.time() + self.ttl_segundos if self.ttl_segundos else None
+
+    def _da_memoria(self, chave: str, agora: float):
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None:
+                expira_em, valor = item
+                if expira_em is None or expira_em > agora:
+                    self._itens.move_to_end(chave)
+                    self.hits_memoria += 1
+                    return True, valor
+                del self._itens[chave]
+        return False, None
+
+    def _falha(self):
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _do_disco(self, chave: str, agora: float):
+        with self._lock:
+            linha = self._db.execute(
+                "SELECT valor, expira_em FROM cache WHERE chave = ?", (chave,)
+            ).fetchone()
+            # Itens expirados no disco são removidos na próxima poda
+            if linha is None or (linha[1] is not None and linha[1] <= agora):
+                self.misses += 1
+                return None
+            valor_json, expira_em = linha
+            valor = json.loads(valor_json)
+            self._guardar_memoria(chave, expira_em, valor)
+            self.hits_disco += 1
+            self._acessos_pendentes[chave] = agora
+            if len(self._acessos_pendentes) >= CACHE_ACESSOS_POR_GRAVACAO:
+                self._gravar_acessos()
+                self._db.commit()
+            return valor
+
+    def get(self, chave: str):
+        """Retorna o valor guardado para `chave` ou None se ausente ou expirado."""
+        agora = time.time()
+        achou, valor = self._da_memoria(chave, agora)
+        if achou:
+            return valor
+        if self._caminho_db is None:
+            return self._falha()
+        return self._do_disco(chave, agora)
+
+    async def aget(self, chave: str):
+        """`get` para código assíncrono: a camada em memória é consultada direto e só a
+        leitura do SQLite vai para o pool de threads, fora do event loop."""
+        agora = time.time()
+        achou, valor = self._da_memoria(chave, agora)
+        if achou:
+            return valor
+        if self._caminho_db is None:
+            return self._falha()
+        return await executar("cache", self._do_disco, chave, agora)
+
+    def set(self, chave: str, valor):
+        """Guarda `valor` (serializável em JSON) nas camadas de memória e disco."""
+        self.set_muitos({chave: valor})
+
+    async def aset(self, chave: str, valor):
+        """`set` para código assíncrono, com a escrita no SQLite feita no pool de threads."""
+        if self._caminho_db is None:
+            self.set(chave, valor)
+        else:
+            await executar("cache", self.set, chave, valor)
+
+    def set_muitos(self, itens: dict):
+        """Guarda vários valores de uma vez, com uma única transação e poda no disco."""
+        expira_em = self._expira_em()
+        with self._lock:
+            for chave, valor in itens.items():
+                self._guardar_memoria(chave, expira_em, valor)
+            if self._caminho_db is not None:
+                agora = time.time()
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO cache (chave, valor, expira_em, acessado_em) VALUES (?, ?, ?, ?)",
+                    [(chave, json.dumps(valor, ensure_ascii=False), expira_em, agora) for chave, valor in itens.items()],
+                )
+                for chave in itens:
+                    self._acessos_pendentes.pop(chave, None)
+                self._gravar_acessos()
+                self._total_disco += len(itens)
+                if self._total_disco > self.max_itens_disco:
+                    self._podar_disco()
+                self._db.commit()
+
+    def clear(self):
+        """Remove todos os itens das duas camadas."""
+        with self._lock:
+            self._itens.clear()
+            if self._caminho_db is not None:
+                self._db.execute("DELETE FROM cache")
+                self._db.commit()
+                self._acessos_pendentes.clear()
+                self._total_disco = 0
+
+    def estatisticas(self) -> dict:
+        """Contadores de acertos e falhas, úteis para acompanhar a eficácia do cache."""
+        with self._lock:
+            return {
+                "itens_memoria": len(self._itens),
+                "hits_memoria": self.hits_memoria,
+                "hits_disco": self.hits_disco,
+                "misses": self.misses,
+            }
+
+    def _guardar_memoria(self, chave, expira_em, valor):
+        self._itens[chave] = (expira_em, valor)
+        self._itens.move_to_end(chave)
+        while len(self._itens) > self.max_itens:
+            self._itens.popitem(last=False)
+
+    def _gravar_acessos(self):
+        if self._acessos_pendentes:
+            self._db.executemany(
+                "UPDATE cache SET acessado_em = ? WHERE chave = ?",
+                [(agora, chave) for chave, agora in self._acessos_pendentes.items()],
+            )
+            self._acessos_pendentes.clear()
+
+    def _podar_disco(self):
+        """Remove os expirados e, se ainda acima do limite, os menos acessados até 90% do
+        limite, para que a contagem (cara) da tabela não se repita a cada escrita."""
+        self._db.execute("DELETE FROM cache WHERE expira_em IS NOT NULL AND expira_em <= ?", (time.time(),))
+        (total,) = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()
+        if total > self.max_itens_disco:
+            excedente = total - int(self.max_itens_disco * 0.9)
+            self._db.execute(
+                "DELETE FROM cache WHERE chave IN (SELECT chave FROM cache ORDER BY acessado_em LIMIT ?)",
+                (excedente,),
+            )
+            total -= excedente
+        self._total_disco = total
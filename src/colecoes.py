@@ -0,0 +1,127 @@
+import os
+import re
+import uuid
+import threading
+from .recuperacao import IndiceBM25
+
+# --- Coleções por Curso / Usuário ---
+# Cada curso (ou usuário) tem sua própria coleção no ChromaDB, com índice BM25 e marcador
+# de versão próprios. Assim a busca percorre apenas o material daquela turma e arquivos
+# com o mesmo nome enviados por turmas diferentes não se sobrescrevem.
+
+# Regras de nome de coleção do ChromaDB: 3 a 63 caracteres, começando e terminando com letra ou número
+NOME_COLECAO = re.compile(r"^[a-zA-Z0-9][a-zA-Z0-9._-]{1,61}[a-zA-Z0-9]$")
+
+
+class Colecao:
+    def __init__(self, nome: str, client, embeddings, diretorio: str):
+        from langchain_chroma import Chroma
+        self.nome = nome
+        self.vector_store = Chroma(client=client, collection_name=nome, embedding_function=embeddings)
+        self.indice_lexico = IndiceBM25(os.path.join(diretorio, f"bm25_{nome}.sqlite3"))
+        self._caminho_versao = os.path.join(diretorio, f"versao_{nome}")
+        self._total = None
+        self._versao_total = None
+
+    # --- Versão da Coleção ---
+    # Um marcador em disco muda a cada alteração na coleção; respostas guardadas em cache
+    # sob uma versão anterior deixam de ser usadas. Por ficar em disco, vale também entre
+    # vários workers do uvicorn.
+    def versao(self) -> str:
+        try:
+            with open(self._caminho_versao) as f:
+                return f"{self.nome}:{f.read()}"
+        except FileNotFoundError:
+            return f"{self.nome}:"
+
+    def invalidar(self):
+        """Marca a coleção como alterada, invalidando o cache de respostas e a contagem."""
+        temporario = f"{self._caminho_versao}.{uuid.uuid4().hex}"
+        with open(temporario, "w") as f:
+            f.write(uuid.uuid4().hex)
+        os.replace(temporario, self._caminho_versao)
+
+    def contar(self) -> int:
+        """Quantidade de chunks, recontada no ChromaDB apenas quando a versão muda."""
+        versao = self.versao()
+        if versao != self._versao_total:
+            self._total = self.vector_store._collection.count()
+            self._versao_total = versao
+        return self._total
+
+    def documentos(self) -> list[dict]:
+        return [{"source": source, "chunks": chunks} for source, chunks in self.indice_lexico.listar_sources()]
+
+    def remover_documento(self, source: str) -> int:
+        existentes = self.vector_store.get(where={"source": source}, include=[])
+        ids = existentes["ids"] if existentes else []
+        if ids:
+            self.vector_store.delete(ids=ids)
+            self.indice_lexico.remover(ids)
+            self.invalidar()
+        return len(ids)
+
+    def sincronizar_indice_lexico(self, tamanho_pagina: int = 1000):
+        """Reconstrói o índice BM25 a partir da coleção quando os dois divergem (ex.: coleção
+        criada antes da busca híbrida existir)."""
+        colecao = self.vector_store._collection
+        total = colecao.count()
+        if self.indice_lexico.contar() == total:
+            return
+        self.indice_lexico.limpar()
+        for offset in range(0, total, tamanho_pagina):
+            pagina = colecao.get(include=["documents", "metadatas"], limit=tamanho_pagina, offset=offset)
+            sources = [(m or {}).get("source", "Fonte desconhecida") for m in pagina["metadatas"]]
+            self.indice_lexico.adicionar(pagina["ids"], pagina["documents"], sources)
+
+
+class RegistroColecoes:
+    """Mantém uma instância de `Colecao` por nome, criando coleções sob demanda. O cliente
+    do ChromaDB é obtido de `obter_client` apenas no primeiro uso."""
+
+    def __init__(self, obter_client, embeddings, diretorio: str):
+        self._obter_client = obter_client
+        self.embeddings = embeddings
+        self.diretorio = diretorio
+        self._colecoes: dict[str, Colecao] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        return self._obter_client()
+
+    def nomes(self) -> list[str]:
+        # Versões recentes do ChromaDB retornam apenas os nomes; as antigas, objetos Collection
+        return sorted(getattr(c, "name", c) for c in self.client.list_collections())
+
+    def obter(self, nome: str, criar: bool = False) -> Colecao | None:
+        """Retorna a coleção `nome`. Se ela não existir, cria quando `criar` for verdadeiro
+        ou retorna None."""
+        if not NOME_COLECAO.match(nome):
+            raise ValueError(
+                "Nome de coleção inválido. Use de 3 a 63 letras, números, '.', '_' ou '-', "
+                "começando e terminando com letra ou número."
+            )
+        with self._lock:
+            colecao = self._colecoes.get(nome)
+            if colecao is None:
+                if not criar and nome not in self.nomes():
+                    return None
+                colecao = Colecao(nome, self.client, self.embeddings, self.diretorio)
+                self._colecoes[nome] = colecao
+            return colecao
+
+    def excluir(self, nome: str) -> bool:
+        with self._lock:
+            if nome not in self.nomes():
+                return False
+            self.client.delete_collection(nome)
+            colecao = self._colecoes.pop(nome, None)
+            if colecao is not None:
+                colecao.indice_lexico.limpar()
+                colecao.invalidar()
+            else:
+                caminho = os.path.join(self.diretorio, f"bm25_{nome}.sqlite3")
+                if os.path.exists(caminho):
+                    os.remove(caminho)
+            return True
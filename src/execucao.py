@@ -0,0 +1,82 @@
+import os
+import asyncio
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Limites de Concorrência por Serviço Externo ---
+# Os SDKs do Gemini, do Vision e do ChromaDB são síncronos. Cada serviço externo
+# ganha seu próprio pool de threads limitado, assim uma correção lenta no Gemini
+# não trava o event loop nem ocupa as threads usadas pelo Vision ou pelo ChromaDB.
+LIMITES_CONCORRENCIA = {
+    "gemini": int(os.environ.get("GEMINI_MAX_CONCURRENCY", "32")),
+    "vision": int(os.environ.get("VISION_MAX_CONCURRENCY", "16")),
+    "imagem": int(os.environ.get("IMAGEM_MAX_CONCURRENCY", str(os.cpu_count() or 2))),
+    "embeddings": int(os.environ.get("EMBEDDINGS_MAX_CONCURRENCY", "4")),
+    "chroma": int(os.environ.get("CHROMA_MAX_CONCURRENCY", "8")),
+    "ingestao": int(os.environ.get("INGESTAO_MAX_CONCURRENCY", "2")),
+    # Acesso ao armazenamento local (SQLite) dos lotes de correção
+    "lotes": int(os.environ.get("LOTES_DB_MAX_CONCURRENCY", "4")),
+    # Camada em disco (SQLite) dos caches de correções e OCR
+    "cache": int(os.environ.get("CACHE_DB_MAX_CONCURRENCY", "4")),
+}
+
+_pools: dict[str, ThreadPoolExecutor] = {}
+
+
+def _obter_pool(upstream: str) -> ThreadPoolExecutor:
+    """Retorna (criando sob demanda) o pool de threads dedicado ao serviço externo."""
+    pool = _pools.get(upstream)
+    if pool is None:
+        pool = ThreadPoolExecutor(
+            max_workers=LIMITES_CONCORRENCIA[upstream],
+            thread_name_prefix=f"upstream-{upstream}",
+        )
+        _pools[upstream] = pool
+    return pool
+
+
+async def executar(upstream: str, func, *args, **kwargs):
+    """Executa uma chamada bloqueante no pool do serviço externo sem bloquear o event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_obter_pool(upstream), functools.partial(func, *args, **kwargs))
+
+
+async def iterar(upstream: str, func, *args, **kwargs):
+    """Consome um iterador bloqueante (ex.: resposta em streaming do Gemini) no pool do
+    serviço externo, entregando cada item ao event loop assim que ele é produzido."""
+    loop = asyncio.get_running_loop()
+    fila: asyncio.Queue = asyncio.Queue()
+    fim = object()
+    interrompido = threading.Event()
+
+    def produzir():
+        try:
+            for item in func(*args, **kwargs):
+                if interrompido.is_set():
+                    break
+                loop.call_soon_threadsafe(fila.put_nowait, (item, None))
+        except BaseException as e:
+            loop.call_soon_threadsafe(fila.put_nowait, (fim, e))
+        else:
+            loop.call_soon_threadsafe(fila.put_nowait, (fim, None))
+
+    loop.run_in_executor(_obter_pool(upstream), produzir)
+    try:
+        while True:
+            item, erro = await fila.get()
+            if erro is not None:
+                raise erro
+            if item is fim:
+                break
+            yield item
+    finally:
+        # Se o cliente desconectar, a thread para de consumir o iterador no próximo item
+        interrompido.set()
+
+
+def encerrar():
+    """Encerra todos os pools de threads (usado no desligamento da aplicação)."""
+    for pool in _pools.values():
+        pool.shutdown(wait=False, cancel_futures=True)
+    _pools.clear()
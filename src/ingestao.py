@@ -0,0 +1,230 @@
+import os
+import uuid
+import time
+import asyncio
+import multiprocessing
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field, asdict
+from concurrent.futures import ProcessPoolExecutor
+
+# --- Pipeline de Ingestão em Segundo Plano ---
+# Os documentos são lidos página a página (ou slide a slide) em um pool de processos,
+# assim a extração de texto, que é CPU-bound, não disputa o GIL com a API e a memória
+# usada fica limitada a algumas páginas por vez, qualquer que seja o tamanho do arquivo.
+
+INGESTAO_PROCESSOS = int(os.environ.get("INGESTAO_PROCESSOS", str(min(4, os.cpu_count() or 1))))
+INGESTAO_PAGINAS_POR_LOTE = int(os.environ.get("INGESTAO_PAGINAS_POR_LOTE", "8"))
+INGESTAO_MAX_JOBS_RETIDOS = int(os.environ.get("INGESTAO_MAX_JOBS_RETIDOS", "200"))
+
+_pool_processos: ProcessPoolExecutor | None = None
+
+
+def _obter_pool() -> ProcessPoolExecutor:
+    global _pool_processos
+    if _pool_processos is None:
+        # "spawn" em vez do fork padrão do Linux: o processo da API já tem threads
+        # (pools de execução, gRPC, SQLite) e um fork copiaria locks possivelmente travados
+        _pool_processos = ProcessPoolExecutor(
+            max_workers=INGESTAO_PROCESSOS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool_processos
+
+
+def encerrar():
+    """Encerra o pool de processos (usado no desligamento da aplicação)."""
+    global _pool_processos
+    if _pool_processos is not None:
+        _pool_processos.shutdown(wait=False, cancel_futures=True)
+        _pool_processos = None
+
+
+# --- Extração de Texto (executada nos processos do pool) ---
+def _contar_paginas(filepath: str, formato: str) -> int:
+    if formato == "pdf":
+        from pypdf import PdfReader
+        return len(PdfReader(filepath).pages)
+    if formato == "pptx":
+        from pptx import Presentation
+        return len(Presentation(filepath).slides)
+    # Arquivos .ppt antigos são convertidos pelo unstructured como um bloco único
+    return 1
+
+
+# Apresentação aberta por último neste processo do pool: os lotes seguintes do mesmo
+# arquivo reaproveitam o parse em vez de ler o .pptx inteiro de novo a cada lote.
+_apresentacao_aberta: tuple | None = None
+
+
+def _abrir_apresentacao(filepath: str):
+    global _apresentacao_aberta
+    from pptx import Presentation
+    chave = (filepath, os.stat(filepath).st_mtime_ns)
+    if _apresentacao_aberta is None or _apresentacao_aberta[0] != chave:
+        # Descarta a anterior antes de abrir a nova, para não manter duas em memória
+        _apresentacao_aberta = None
+        _apresentacao_aberta = (chave, Presentation(filepath))
+    return _apresentacao_aberta[1]
+
+
+def _textos_dos_shapes(shapes) -> list[str]:
+    """Texto das caixas de texto, tabelas e grupos (recursivamente) de um slide."""
+    from pptx.enum.shapes import MSO_SHAPE_TYPE
+    textos = []
+    for shape in shapes:
+        if shape.shape_type == MSO_SHAPE_TYPE.GROUP:
+            textos.extend(_textos_dos_shapes(shape.shapes))
+        elif shape.has_text_frame:
+            textos.append(shape.text_frame.text)
+        elif getattr(shape, "has_table", False) and shape.has_table:
+            for linha in shape.table.rows:
+                celulas = [celula.text.strip() for celula in linha.cells]
+                textos.append(" | ".join(c for c in celulas if c))
+    return textos
+
+
+def _extrair_paginas(filepath: str, formato: str, inicio: int, fim: int) -> list[tuple[int, str]]:
+    """Retorna (número da página, texto) das páginas no intervalo [inicio, fim)."""
+    if formato == "pdf":
+        from pypdf import PdfReader
+        reader = PdfReader(filepath)
+        return [(i, reader.pages[i].extract_text() or "") for i in range(inicio, fim)]
+    if formato == "pptx":
+        slides = _abrir_apresentacao(filepath).slides
+        paginas = []
+        for numero in range(inicio, fim):
+            textos = _textos_dos_shapes(slides[numero].shapes)
+            paginas.append((numero, "\n\n".join(t for t in textos if t.strip())))
+        return paginas
+    from langchain_community.document_loaders import UnstructuredPowerPointLoader
+    return [(0, "\n\n".join(doc.page_content for doc in UnstructuredPowerPointLoader(filepath).load()))]
+
+
+def formato_do_arquivo(filename: str) -> str | None:
+    if filename.endswith(".pdf"):
+        return "pdf"
+    if filename.endswith(".pptx"):
+        return "pptx"
+    if filename.endswith(".ppt"):
+        return "ppt"
+    return None
+
+
+async def contar_paginas(filepath: str, formato: str) -> int:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_obter_pool(), _contar_paginas, filepath, formato)
+
+
+async def paginas(filepath: str, formato: str, total: int):
+    """Gera lotes de páginas na ordem do documento. No máximo INGESTAO_PROCESSOS lotes
+    ficam em processamento ao mesmo tempo, o que limita a memória em uso."""
+    loop = asyncio.get_running_loop()
+    pool = _obter_pool()
+    intervalos = [(i, min(i + INGESTAO_PAGINAS_POR_LOTE, total)) for i in range(0, total, INGESTAO_PAGINAS_POR_LOTE)]
+    em_andamento = []
+    proximo = 0
+    try:
+        while proximo < len(intervalos) or em_andamento:
+            while proximo < len(intervalos) and len(em_andamento) < INGESTAO_PROCESSOS:
+                inicio, fim = intervalos[proximo]
+                em_andamento.append(loop.run_in_executor(pool, _extrair_paginas, filepath, formato, inicio, fim))
+                proximo += 1
+            yield await em_andamento.pop(0)
+    finally:
+        for futuro in em_andamento:
+            futuro.cancel()
+
+
+# --- Registro de Jobs de Ingestão ---
+class IngestaoCancelada(Exception):
+    pass
+
+
+@dataclass
+class JobIngestao:
+    filename: str
+    colecao: str
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = "pendente"
+    paginas_total: int | None = None
+    paginas_processadas: int = 0
+    chunks_total: int = 0
+    chunks_vetorizados: int = 0
+    chunks_reaproveitados: int = 0
+    chunks_removidos: int = 0
+    erro: str | None = None
+    criado_em: float = field(default_factory=time.time)
+    cancelado: bool = False
+
+    def verificar_cancelamento(self):
+        if self.cancelado:
+            raise IngestaoCancelada()
+
+    def em_andamento(self) -> bool:
+        return self.status in ("pendente", "processando")
+
+    def para_dict(self) -> dict:
+        dados = asdict(self)
+        dados.pop("cancelado")
+        return dados
+
+
+jobs: dict[str, JobIngestao] = {}
+_tarefas: set[asyncio.Task] = set()
+# (coleção, arquivo) -> [lock, jobs usando ou esperando o lock]
+_locks_documentos: dict[tuple[str, str], list] = {}
+
+
+def criar_job(filename: str, colecao: str) -> JobIngestao:
+    """Registra um novo job. Um job ainda ativo para o mesmo arquivo na mesma coleção é
+    cancelado, já que a versão mais recente vai substituí-lo."""
+    for job in jobs.values():
+        if job.filename == filename and job.colecao == colecao and job.em_andamento():
+            job.cancelado = True
+    job = JobIngestao(filename=filename, colecao=colecao)
+    jobs[job.id] = job
+    # Descarta os jobs finalizados mais antigos
+    finalizados = sorted((j for j in jobs.values() if not j.em_andamento()), key=lambda j: j.criado_em)
+    for antigo in finalizados[:max(0, len(jobs) - INGESTAO_MAX_JOBS_RETIDOS)]:
+        del jobs[antigo.id]
+    return job
+
+
+@asynccontextmanager
+async def exclusivo(job: JobIngestao):
+    """Garante que um único job por vez processe o mesmo arquivo na mesma coleção. O job
+    que substitui outro só começa depois que o cancelado terminou de gravar seus lotes,
+    para que a comparação de ids veja tudo o que o anterior deixou no ChromaDB."""
+    chave = (job.colecao, job.filename)
+    entrada = _locks_documentos.setdefault(chave, [asyncio.Lock(), 0])
+    entrada[1] += 1
+    try:
+        async with entrada[0]:
+            yield
+    finally:
+        entrada[1] -= 1
+        if entrada[1] == 0:
+            del _locks_documentos[chave]
+
+
+def agendar(job: JobIngestao, corrotina):
+    """Executa a ingestão em segundo plano, registrando o status final no job."""
+    async def executar_job():
+        job.status = "processando"
+        try:
+            await corrotina
+            job.status = "concluido"
+        except (IngestaoCancelada, asyncio.CancelledError):
+            job.status = "cancelado"
+        except Exception as e:
+            job.status = "erro"
+            job.erro = str(e)
+
+    tarefa = asyncio.create_task(executar_job())
+    _tarefas.add(tarefa)
+    tarefa.add_done_callback(_tarefas.discard)
+
+
+async def cancelar_tarefas():
+    for tarefa in list(_tarefas):
+        tarefa.cancel()
+    await asyncio.gather(*_tarefas, return_exceptions=True)
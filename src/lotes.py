@@ -0,0 +1,271 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+from fastapi import APIRouter, File, UploadFile, HTTPException, Form
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from .execucao import executar
+from .sse import formatar_evento, com_heartbeat, SSE_HEADERS
+from . import redacao, recursos
+from .agendador import ErroUpstream, PRIORIDADE_LOTE
+
+# --- Configuração do Roteador ---
+router = APIRouter()
+
+# --- Constantes e Configurações Globais ---
+LOTES_DB_PATH = os.environ.get("LOTES_DB_PATH", "lotes.sqlite3")
+LOTES_MAX_WORKERS = int(os.environ.get("LOTES_MAX_WORKERS", "8"))
+LOTES_MAX_ITENS = int(os.environ.get("LOTES_MAX_ITENS", "100"))
+LOTES_INTERVALO_STREAM = float(os.environ.get("LOTES_INTERVALO_STREAM", "0.5"))
+
+# --- Modelos de Dados (Pydantic) ---
+class LoteCriadoResponse(BaseModel):
+    id: str
+    status: str
+    total: int
+
+class ItemLote(BaseModel):
+    indice: int
+    nome: str | None
+    status: str
+    resultado: dict | None = None
+    erro: str | None = None
+
+class LoteResponse(BaseModel):
+    id: str
+    tipo: str
+    genero: str | None
+    status: str
+    total: int
+    concluidos: int
+    itens: list[ItemLote]
+
+
+# --- Armazenamento Local dos Lotes (SQLite) ---
+class LoteStore:
+    """Persistência dos lotes e de seus itens em um arquivo SQLite local."""
+
+    def __init__(self, caminho: str):
+        self._db = sqlite3.connect(caminho, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS lotes (
+                    id TEXT PRIMARY KEY, tipo TEXT NOT NULL, genero TEXT,
+                    status TEXT NOT NULL, criado_em REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS itens (
+                    lote_id TEXT NOT NULL, indice INTEGER NOT NULL, nome TEXT,
+                    texto TEXT, imagem BLOB, status TEXT NOT NULL,
+                    resultado TEXT, erro TEXT, concluido_em REAL,
+                    PRIMARY KEY (lote_id, indice)
+                );
+            """)
+            self._db.commit()
+
+    def criar(self, tipo: str, genero: str | None, entradas: list[dict]) -> str:
+        lote_id = uuid.uuid4().hex
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO lotes (id, tipo, genero, status, criado_em) VALUES (?, ?, ?, 'pendente', ?)",
+                (lote_id, tipo, genero, time.time()),
+            )
+            self._db.executemany(
+                "INSERT INTO itens (lote_id, indice, nome, texto, imagem, status) VALUES (?, ?, ?, ?, ?, 'pendente')",
+                [(lote_id, i, e.get("nome"), e.get("texto"), e.get("imagem")) for i, e in enumerate(entradas)],
+            )
+            self._db.commit()
+        return lote_id
+
+    def obter(self, lote_id: str) -> dict | None:
+        with self._lock:
+            lote = self._db.execute(
+                "SELECT id, tipo, genero, status FROM lotes WHERE id = ?", (lote_id,)
+            ).fetchone()
+            if lote is None:
+                return None
+            itens = self._db.execute(
+                "SELECT indice, nome, status, resultado, erro FROM itens WHERE lote_id = ? ORDER BY indice",
+                (lote_id,),
+            ).fetchall()
+        itens = [
+            {"indice": i, "nome": n, "status": s, "resultado": json.loads(r) if r else None, "erro": e}
+            for i, n, s, r, e in itens
+        ]
+        return {
+            "id": lote[0], "tipo": lote[1], "genero": lote[2], "status": lote[3],
+            "total": len(itens),
+            "concluidos": sum(1 for item in itens if item["status"] in ("concluido", "erro")),
+            "itens": itens,
+        }
+
+    def itens_pendentes(self, lote_id: str) -> list[tuple]:
+        with self._lock:
+            return self._db.execute(
+                "SELECT indice, texto, imagem FROM itens WHERE lote_id = ? AND status = 'pendente'",
+                (lote_id,),
+            ).fetchall()
+
+    def lotes_inacabados(self) -> list[tuple]:
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, tipo, genero FROM lotes WHERE status IN ('pendente', 'processando')"
+            ).fetchall()
+
+    def atualizar_lote(self, lote_id: str, status: str):
+        with self._lock:
+            self._db.execute("UPDATE lotes SET status = ? WHERE id = ?", (status, lote_id))
+            self._db.commit()
+
+    def concluir_item(self, lote_id: str, indice: int, resultado: dict | None = None, erro: str | None = None):
+        # A imagem deixa de ser necessária quando o item termina
+        with self._lock:
+            self._db.execute(
+                "UPDATE itens SET status = ?, resultado = ?, erro = ?, imagem = NULL, concluido_em = ? "
+                "WHERE lote_id = ? AND indice = ?",
+                (
+                    "erro" if erro else "concluido",
+                    json.dumps(resultado, ensure_ascii=False) if resultado is not None else None,
+                    erro, time.time(), lote_id, indice,
+                ),
+            )
+            self._db.commit()
+
+
+# O banco só é aberto (e o arquivo criado) no primeiro uso, não ao importar o módulo
+recursos.registrar("lotes_store", lambda: LoteStore(LOTES_DB_PATH))
+
+
+async def _banco(metodo, *args, **kwargs):
+    """Executa `metodo` do LoteStore (ex.: `LoteStore.obter`) no pool de threads do banco."""
+    return await executar("lotes", lambda: metodo(recursos.obter("lotes_store"), *args, **kwargs))
+
+# Limita quantas redações (OCR + correção) são processadas ao mesmo tempo somando todos os lotes
+_semaforo_workers: asyncio.Semaphore | None = None
+_tarefas: set[asyncio.Task] = set()
+
+
+def _semaforo() -> asyncio.Semaphore:
+    global _semaforo_workers
+    if _semaforo_workers is None:
+        _semaforo_workers = asyncio.Semaphore(LOTES_MAX_WORKERS)
+    return _semaforo_workers
+
+
+# --- Processamento dos Lotes ---
+async def _processar_item(lote_id: str, tipo: str, genero: str | None, indice: int, texto: str | None, imagem: bytes | None):
+    while True:
+        async with _semaforo():
+            try:
+                if texto is None:
+                    texto = await redacao.extrair_texto_bytes(imagem, PRIORIDADE_LOTE)
+                resultado = await redacao.corrigir_redacao(tipo, texto, genero, PRIORIDADE_LOTE)
+                await _banco(LoteStore.concluir_item, lote_id, indice, resultado=resultado)
+                return
+            except ErroUpstream as e:
+                espera = e.retry_after
+            except HTTPException as e:
+                await _banco(LoteStore.concluir_item, lote_id, indice, erro=str(e.detail))
+                return
+            except Exception as e:
+                await _banco(LoteStore.concluir_item, lote_id, indice, erro=str(e))
+                return
+        # Cota esgotada ou serviço indisponível não é falha da redação: o item continua
+        # pendente e é tentado de novo após o `retry_after`, sem ocupar a vaga de worker
+        await asyncio.sleep(espera)
+
+
+async def processar_lote(lote_id: str, tipo: str, genero: str | None):
+    """Processa os itens ainda pendentes do lote, respeitando o limite global de workers."""
+    await _banco(LoteStore.atualizar_lote, lote_id, "processando")
+    pendentes = await _banco(LoteStore.itens_pendentes, lote_id)
+    await asyncio.gather(*(
+        _processar_item(lote_id, tipo, genero, indice, texto, imagem)
+        for indice, texto, imagem in pendentes
+    ))
+    await _banco(LoteStore.atualizar_lote, lote_id, "concluido")
+
+
+def _agendar(lote_id: str, tipo: str, genero: str | None):
+    tarefa = asyncio.create_task(processar_lote(lote_id, tipo, genero))
+    _tarefas.add(tarefa)
+    tarefa.add_done_callback(_tarefas.discard)
+
+
+async def retomar_lotes():
+    """Reagenda lotes que ficaram inacabados quando a API foi desligada."""
+    for lote_id, tipo, genero in await _banco(LoteStore.lotes_inacabados):
+        _agendar(lote_id, tipo, genero)
+
+
+async def cancelar_tarefas():
+    """Interrompe os lotes em andamento; eles são retomados na próxima inicialização."""
+    for tarefa in list(_tarefas):
+        tarefa.cancel()
+    await asyncio.gather(*_tarefas, return_exceptions=True)
+
+
+# --- Endpoints da API de Lotes ---
+@router.post("", response_model=LoteCriadoResponse, summary="Cria um lote de correções")
+async def criar_lote(
+    tipo: str = Form(...),
+    genero: str | None = Form(None),
+    textos: list[str] = Form([]),
+    fotos: list[UploadFile] = File([]),
+):
+    if tipo not in ("enem", "ufsc"):
+        raise HTTPException(status_code=400, detail="Tipo de prova inválido. Use 'enem' ou 'ufsc'.")
+    if tipo == "ufsc" and not genero:
+        raise HTTPException(status_code=400, detail="O gênero textual é obrigatório para redações da UFSC.")
+
+    entradas = [{"nome": f"texto-{i + 1}", "texto": texto} for i, texto in enumerate(textos) if texto.strip()]
+    for foto in fotos:
+        entradas.append({"nome": foto.filename, "imagem": await foto.read()})
+
+    if not entradas:
+        raise HTTPException(status_code=400, detail="Envie ao menos um texto ou uma foto de redação.")
+    if len(entradas) > LOTES_MAX_ITENS:
+        raise HTTPException(status_code=400, detail=f"Um lote aceita no máximo {LOTES_MAX_ITENS} redações.")
+
+    lote_id = await _banco(LoteStore.criar, tipo, genero, entradas)
+    _agendar(lote_id, tipo, genero)
+    return {"id": lote_id, "status": "pendente", "total": len(entradas)}
+
+
+@router.get("/{lote_id}", response_model=LoteResponse, summary="Consulta o andamento de um lote")
+async def consultar_lote(lote_id: str):
+    lote = await _banco(LoteStore.obter, lote_id)
+    if lote is None:
+        raise HTTPException(status_code=404, detail="Lote não encontrado.")
+    return lote
+
+
+@router.get("/{lote_id}/stream", summary="Acompanha os resultados de um lote via SSE")
+async def acompanhar_lote(lote_id: str):
+    lote = await _banco(LoteStore.obter, lote_id)
+    if lote is None:
+        raise HTTPException(status_code=404, detail="Lote não encontrado.")
+
+    async def eventos():
+        enviados = set()
+        while True:
+            lote = await _banco(LoteStore.obter, lote_id)
+            novos = [
+                item for item in lote["itens"]
+                if item["status"] in ("concluido", "erro") and item["indice"] not in enviados
+            ]
+            for item in novos:
+                enviados.add(item["indice"])
+                yield formatar_evento("item", item)
+            if novos:
+                yield formatar_evento("progresso", {"concluidos": lote["concluidos"], "total": lote["total"]})
+            if lote["status"] == "concluido" or len(enviados) == lote["total"]:
+                yield formatar_evento("fim", {"id": lote_id, "status": lote["status"]})
+                return
+            await asyncio.sleep(LOTES_INTERVALO_STREAM)
+
+    return StreamingResponse(com_heartbeat(eventos()), media_type="text/event-stream", headers=SSE_HEADERS)
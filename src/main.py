@@ -1,11 +1,129 @@
-from fastapi import FastAPI
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from . import redacao, rag
+from . import redacao, rag, lotes, ingestao, execucao, recursos, metricas
+from .agendador import ErroUpstream
+
+# --- Inicialização em Segundo Plano ---
+# A API aceita conexões logo após o import (os SDKs pesados só são importados ao criar
+# os recursos). Clientes, modelos, cadeias e o índice léxico são preparados em segundo
+# plano: /health/live indica apenas que o processo responde, e /health/ready só retorna
+# 200 quando as capacidades obrigatórias da réplica estão prontas. É esta que o
+# balanceador deve usar para decidir quando enviar tráfego a uma réplica nova.
+logger = logging.getLogger(__name__)
+
+INICIALIZACAO_INTERVALO_RETENTATIVA = float(os.environ.get("INICIALIZACAO_INTERVALO_RETENTATIVA", "30"))
+
+# Componentes de que cada capacidade da API depende
+CAPACIDADES = {
+    "correcao_texto": ["gemini_correcao"],
+    "correcao_imagem": ["gemini_correcao", "vision_client"],
+    "lotes": ["lotes_store", "retomada_lotes"],
+    "rag": ["chroma_client", "rag_embeddings", "rag_llm", "rag_document_chain", "indice_lexico"],
+}
+# Capacidades exigidas por /health/ready (ex.: "rag" em uma réplica só do tutor, sem Vision).
+# As demais continuam sendo preparadas e aparecem no relatório, mas não seguram o tráfego.
+CAPACIDADES_OBRIGATORIAS = [
+    nome.strip()
+    for nome in os.environ.get("CAPACIDADES_OBRIGATORIAS", ",".join(CAPACIDADES)).split(",")
+    if nome.strip()
+]
+if set(CAPACIDADES_OBRIGATORIAS) - set(CAPACIDADES):
+    raise ValueError(
+        f"CAPACIDADES_OBRIGATORIAS contém capacidades desconhecidas; use: {', '.join(CAPACIDADES)}."
+    )
+
+# status: "iniciando", "pronto" (capacidades obrigatórias prontas) ou "incompleto"
+# (alguma obrigatória falhou e será tentada de novo)
+estado = {"status": "iniciando", "componentes": {}, "iniciado_em": time.time(), "pronto_em": None}
+
+
+def capacidades_prontas() -> dict[str, bool]:
+    componentes = estado["componentes"]
+    return {
+        nome: all(componentes.get(componente) == "ok" for componente in dependencias)
+        for nome, dependencias in CAPACIDADES.items()
+    }
+
+
+def _atualizar_status():
+    prontas = capacidades_prontas()
+    if all(prontas.get(nome, False) for nome in CAPACIDADES_OBRIGATORIAS):
+        estado["status"] = "pronto"
+        estado["pronto_em"] = estado["pronto_em"] or time.time()
+    elif any(situacao == "pendente" for situacao in estado["componentes"].values()):
+        estado["status"] = "iniciando"
+    else:
+        estado["status"] = "incompleto"
+
+
+async def _etapa_inicializacao(nome: str, funcao):
+    try:
+        await funcao()
+    except Exception as e:
+        logger.exception("Falha ao inicializar '%s'", nome)
+        estado["componentes"][nome] = f"erro: {e}"
+    else:
+        estado["componentes"][nome] = "ok"
+
+
+async def _inicializar():
+    """Prepara os componentes em segundo plano; o que falhar (credencial ausente, rede
+    indisponível) é tentado de novo a cada INICIALIZACAO_INTERVALO_RETENTATIVA segundos."""
+    componentes = estado["componentes"]
+    nomes_recursos = recursos.registrados()
+    componentes.update({nome: "pendente" for nome in nomes_recursos + ["indice_lexico", "retomada_lotes"]})
+    while True:
+        # Constrói clientes, modelos e cadeias uma única vez
+        # (um por vez, para que /health/ready mostre o progresso)
+        for nome in [nome for nome in nomes_recursos if componentes[nome] != "ok"]:
+            falhas = await asyncio.to_thread(recursos.aquecer, [nome])
+            componentes[nome] = f"erro: {falhas[nome]}" if nome in falhas else "ok"
+            _atualizar_status()
+
+        # Garante que o índice léxico da busca híbrida acompanhe a coleção do ChromaDB
+        if componentes["chroma_client"] == "ok" and componentes["indice_lexico"] != "ok":
+            await _etapa_inicializacao(
+                "indice_lexico", lambda: execucao.executar("chroma", rag.sincronizar_indices_lexicos)
+            )
+        # Retoma lotes de correção interrompidos por uma reinicialização (não dependem do Chroma)
+        if componentes["lotes_store"] == "ok" and componentes["retomada_lotes"] != "ok":
+            await _etapa_inicializacao("retomada_lotes", lotes.retomar_lotes)
+        # O que ainda depende de um recurso que falhou deixa de estar pendente
+        for nome in ("indice_lexico", "retomada_lotes"):
+            if componentes[nome] == "pendente":
+                componentes[nome] = "aguardando dependência"
+
+        _atualizar_status()
+        if all(situacao == "ok" for situacao in componentes.values()):
+            return
+        await asyncio.sleep(INICIALIZACAO_INTERVALO_RETENTATIVA)
+
+
+# --- Ciclo de Vida da Aplicação ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    inicializacao = asyncio.create_task(_inicializar())
+    yield
+    inicializacao.cancel()
+    await asyncio.gather(inicializacao, return_exceptions=True)
+    await lotes.cancelar_tarefas()
+    await ingestao.cancelar_tarefas()
+    ingestao.encerrar()
+    # Libera os pools de threads usados para as chamadas aos serviços externos
+    execucao.encerrar()
+    recursos.limpar()
 
 app = FastAPI(
     title="Hackathon UFSC IA API",
     description="API principal que integra os módulos de correção de redação e RAG.",
-    version="3.0.0"
+    version="3.0.0",
+    lifespan=lifespan,
 )
 
 # --- Middlewares ---
@@ -17,10 +135,25 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Mede cada requisição até o fim da resposta e, se habilitado, registra o trace das etapas
+app.add_middleware(metricas.MiddlewareMetricas)
+
+# --- Tratamento de Erros ---
+# Cota esgotada ou serviço externo indisponível: o cliente recebe 429/503 com Retry-After
+# em vez de um 500 genérico, e pode esperar antes de tentar de novo.
+@app.exception_handler(ErroUpstream)
+async def tratar_erro_upstream(request: Request, erro: ErroUpstream):
+    return JSONResponse(
+        status_code=erro.status_code,
+        content={"detail": str(erro)},
+        headers={"Retry-After": str(erro.retry_after)},
+    )
 
 # --- Inclusão das Rotas ---
 # Incluindo as rotas do módulo de redação
 app.include_router(redacao.router, prefix="/redacao", tags=["Redação"])
+# Incluindo as rotas de correção em lote
+app.include_router(lotes.router, prefix="/redacao/lotes", tags=["Redação em Lote"])
 # Incluindo as rotas do módulo de RAG
 app.include_router(rag.router, prefix="/rag", tags=["RAG"])
 
@@ -29,4 +162,43 @@ def read_root():
     """
     Endpoint raiz para verificar a saúde da API.
     """
-    return {"status": "API online!"}
+    return {"status": "API online!", "pronta": estado["status"] == "pronto"}
+
+@app.get("/health/live", summary="Liveness", description="O processo está de pé e respondendo.")
+def health_live():
+    """
+    Não depende de nenhum serviço externo: falhar aqui significa que o processo deve ser reiniciado.
+    """
+    return {"status": "ok"}
+
+@app.get("/health/ready", summary="Readiness", description="A réplica já pode receber tráfego.")
+def health_ready(capacidade: str | None = None):
+    """
+    Retorna 503 enquanto as capacidades obrigatórias (CAPACIDADES_OBRIGATORIAS) ainda estão
+    sendo preparadas ou falharam e aguardam nova tentativa, com a situação de cada
+    capacidade e componente. Com `?capacidade=rag` verifica apenas a capacidade informada.
+    """
+    prontas = capacidades_prontas()
+    if capacidade is not None:
+        if capacidade not in prontas:
+            return JSONResponse(status_code=404, content={"detail": f"Capacidade desconhecida: {capacidade}"})
+        pronta = prontas[capacidade]
+    else:
+        pronta = estado["status"] == "pronto"
+    agora = time.time()
+    conteudo = {
+        "status": estado["status"],
+        "obrigatorias": CAPACIDADES_OBRIGATORIAS,
+        "capacidades": prontas,
+        "componentes": estado["componentes"],
+        "segundos_desde_inicio": round((estado["pronto_em"] or agora) - estado["iniciado_em"], 2),
+    }
+    return JSONResponse(status_code=200 if pronta else 503, content=conteudo)
+
+@app.get("/metrics", summary="Métricas no formato Prometheus", response_class=PlainTextResponse)
+def exportar_metricas():
+    """
+    Histogramas de duração por etapa, chamadas aos serviços externos, acertos de cache
+    e estimativa de tokens, para coleta pelo Prometheus.
+    """
+    return PlainTextResponse(metricas.exportar(), media_type="text/plain; version=0.0.4; charset=utf-8")
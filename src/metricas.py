@@ -0,0 +1,320 @@
+import os
+import re
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# --- Métricas e Traces por Etapa ---
+# Histogramas de duração por etapa (leitura do upload, OCR, montagem do prompt, geração,
+# parse do JSON, embeddings, busca...), contadores de chamadas aos serviços externos,
+# de erros e de acertos de cache, e uma estimativa de tokens enviados e recebidos.
+# Tudo é exportado no formato texto do Prometheus em /metrics, sem dependências extras.
+# Com METRICAS_TRACE_LOGS=1, cada requisição também gera uma linha de log JSON com
+# a duração de cada etapa pela qual passou.
+
+METRICAS_TRACE_LOGS = os.environ.get("METRICAS_TRACE_LOGS", "0").lower() in ("1", "true", "sim")
+PREFIXO = "cognita_"
+LIMITES_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+logger = logging.getLogger(__name__)
+
+
+def configurar_log_traces(stream=None) -> logging.Handler | None:
+    """Garante que as linhas de trace saiam mesmo sem configuração de logging da aplicação
+    (o nível padrão, WARNING, descartaria os `logger.info`). Retorna o handler instalado."""
+    if not METRICAS_TRACE_LOGS:
+        return None
+    logger.setLevel(logging.INFO)
+    handler = next((h for h in logger.handlers if getattr(h, "_trace_metricas", False)), None)
+    if handler is None or stream is not None:
+        if handler is not None:
+            logger.removeHandler(handler)
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        handler._trace_metricas = True
+        logger.addHandler(handler)
+        # Sem propagar, a mesma linha não sai duas vezes se a raiz também tiver handler
+        logger.propagate = False
+    return handler
+
+
+configurar_log_traces()
+
+_metricas: list = []
+_caches: list = []
+_trace_atual: contextvars.ContextVar[dict | None] = contextvars.ContextVar("trace_atual", default=None)
+
+
+def _escapar(valor: str) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _formatar_rotulos(nomes: tuple, valores: tuple, extra: str = "") -> str:
+    partes = [f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+def _formatar_valor(valor: float) -> str:
+    """Valor completo (sem notação científica de 6 dígitos), para que `rate()` não
+    trabalhe com degraus em contadores grandes como o de tokens."""
+    return str(int(valor)) if float(valor).is_integer() else repr(float(valor))
+
+
+class Contador:
+    def __init__(self, nome: str, descricao: str, rotulos: tuple = ()):
+        self.nome = PREFIXO + nome
+        self.descricao = descricao
+        self.rotulos = rotulos
+        self._valores: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        _metricas.append(self)
+
+    def inc(self, valor: float = 1, **rotulos):
+        chave = tuple(str(rotulos[nome]) for nome in self.rotulos)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+    def exportar(self) -> list[str]:
+        linhas = [f"# HELP {self.nome} {self.descricao}", f"# TYPE {self.nome} counter"]
+        with self._lock:
+            valores = self._valores if self._valores or self.rotulos else {(): 0}
+            for chave, valor in sorted(valores.items()):
+                linhas.append(f"{self.nome}{_formatar_rotulos(self.rotulos, chave)} {_formatar_valor(valor)}")
+        return linhas
+
+
+class Histograma:
+    def __init__(self, nome: str, descricao: str, rotulos: tuple = (), limites: tuple = LIMITES_PADRAO):
+        self.nome = PREFIXO + nome
+        self.descricao = descricao
+        self.rotulos = rotulos
+        self.limites = limites
+        # Para cada combinação de rótulos: contagem por faixa, soma e total
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        _metricas.append(self)
+
+    def observar(self, valor: float, **rotulos):
+        chave = tuple(str(rotulos[nome]) for nome in self.rotulos)
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                serie = self._series[chave] = [[0] * len(self.limites), 0.0, 0]
+            for i, limite in enumerate(self.limites):
+                if valor <= limite:
+                    serie[0][i] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def exportar(self) -> list[str]:
+        linhas = [f"# HELP {self.nome} {self.descricao}", f"# TYPE {self.nome} histogram"]
+        with self._lock:
+            for chave, (faixas, soma, total) in sorted(self._series.items()):
+                for limite, quantidade in zip(self.limites, faixas):
+                    rotulos = _formatar_rotulos(self.rotulos, chave, f'le="{limite:g}"')
+                    linhas.append(f"{self.nome}_bucket{rotulos} {quantidade}")
+                rotulos = _formatar_rotulos(self.rotulos, chave, 'le="+Inf"')
+                linhas.append(f"{self.nome}_bucket{rotulos} {total}")
+                linhas.append(f"{self.nome}_sum{_formatar_rotulos(self.rotulos, chave)} {soma:.6f}")
+                linhas.append(f"{self.nome}_count{_formatar_rotulos(self.rotulos, chave)} {total}")
+        return linhas
+
+
+# --- Métricas da Aplicação ---
+HTTP_DURACAO = Histograma(
+    "http_duracao_segundos", "Duração das requisições HTTP até o fim da resposta.", ("metodo", "rota", "status")
+)
+ETAPA_DURACAO = Histograma(
+    "etapa_duracao_segundos", "Duração de cada etapa do processamento.", ("fluxo", "etapa")
+)
+ETAPA_ERROS = Contador(
+    "etapa_erros_total", "Etapas interrompidas por exceção.", ("fluxo", "etapa", "erro")
+)
+UPSTREAM_CHAMADAS = Contador(
+    "upstream_chamadas_total",
+    "Chamadas aos serviços externos por resultado (sucesso, erro, retentativa, coalescida).",
+    ("upstream", "resultado"),
+)
+UPSTREAM_DURACAO = Histograma(
+    "upstream_duracao_segundos", "Duração de cada chamada a um serviço externo.", ("upstream",)
+)
+UPSTREAM_ESPERA = Histograma(
+    "upstream_espera_fila_segundos", "Tempo de espera na fila do agendador antes da chamada.", ("upstream", "prioridade")
+)
+PAGINAS_INGERIDAS = Contador(
+    "paginas_ingeridas_total", "Páginas (ou slides) de documentos extraídas na ingestão.", ("formato",)
+)
+RELATORIOS = Contador(
+    "relatorios_correcao_total",
+    "Respostas do Gemini por resultado da validação (valido, reparado, parcial, falha).",
+    ("tipo", "resultado"),
+)
+TOKENS = Contador(
+    "tokens_estimados_total", "Tokens estimados (~4 caracteres por token) enviados e recebidos dos modelos.", ("operacao", "tipo")
+)
+
+
+def registrar_cache(cache):
+    """Inclui os contadores de um `CacheLRU` (ou objeto com `nome` e `estatisticas()`) em /metrics."""
+    _caches.append(cache)
+
+
+def _exportar_caches() -> list[str]:
+    nome_hits, nome_misses, nome_itens = f"{PREFIXO}cache_hits_total", f"{PREFIXO}cache_misses_total", f"{PREFIXO}cache_itens"
+    hits = [f"# HELP {nome_hits} Acertos de cache por camada.", f"# TYPE {nome_hits} counter"]
+    misses = [f"# HELP {nome_misses} Falhas de cache.", f"# TYPE {nome_misses} counter"]
+    itens = [f"# HELP {nome_itens} Itens na camada em memória do cache.", f"# TYPE {nome_itens} gauge"]
+    for cache in _caches:
+        estatisticas = cache.estatisticas()
+        rotulo = _escapar(cache.nome)
+        hits.append(f'{nome_hits}{{cache="{rotulo}",camada="memoria"}} {estatisticas["hits_memoria"]}')
+        hits.append(f'{nome_hits}{{cache="{rotulo}",camada="disco"}} {estatisticas["hits_disco"]}')
+        misses.append(f'{nome_misses}{{cache="{rotulo}"}} {estatisticas["misses"]}')
+        itens.append(f'{nome_itens}{{cache="{rotulo}"}} {estatisticas["itens_memoria"]}')
+    return hits + misses + itens
+
+
+def exportar() -> str:
+    """Todas as métricas no formato de exposição em texto do Prometheus."""
+    linhas = []
+    for metrica in _metricas:
+        linhas.extend(metrica.exportar())
+    linhas.extend(_exportar_caches())
+    return "\n".join(linhas) + "\n"
+
+
+# --- Instrumentação ---
+@contextmanager
+def etapa(fluxo: str, nome: str):
+    """Mede a duração do bloco como uma etapa do `fluxo` e a anota no trace da requisição."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        ETAPA_ERROS.inc(fluxo=fluxo, etapa=nome, erro=type(e).__name__)
+        raise
+    finally:
+        _registrar_etapa(fluxo, nome, time.perf_counter() - inicio)
+
+
+def _registrar_etapa(fluxo: str, nome: str, duracao: float):
+    ETAPA_DURACAO.observar(duracao, fluxo=fluxo, etapa=nome)
+    trace = _trace_atual.get()
+    if trace is not None:
+        trace["etapas"].append({"fluxo": fluxo, "etapa": nome, "ms": round(duracao * 1000, 2)})
+
+
+class Cronometro:
+    """Para etapas que não cabem em um bloco `with`, como a espera pelo próximo item de
+    um `async for`: `registrar` anota o tempo desde o último `reiniciar`."""
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+
+    def reiniciar(self):
+        self.inicio = time.perf_counter()
+
+    def registrar(self, fluxo: str, nome: str):
+        _registrar_etapa(fluxo, nome, time.perf_counter() - self.inicio)
+
+
+async def cronometrar(fluxo: str, nome: str, itens):
+    """Repassa os itens de um iterador assíncrono (ex.: o streaming do Gemini) medindo como
+    etapa só o tempo de espera por eles. O tempo em que o consumidor está com o item (envio
+    ao cliente) não entra, e um cliente que desconecta no meio não conta como erro."""
+    iterador = itens.__aiter__()
+    total = 0.0
+    try:
+        while True:
+            inicio = time.perf_counter()
+            try:
+                item = await iterador.__anext__()
+            except StopAsyncIteration:
+                total += time.perf_counter() - inicio
+                return
+            except BaseException as e:
+                total += time.perf_counter() - inicio
+                ETAPA_ERROS.inc(fluxo=fluxo, etapa=nome, erro=type(e).__name__)
+                raise
+            total += time.perf_counter() - inicio
+            yield item
+    finally:
+        _registrar_etapa(fluxo, nome, total)
+        # Encerra o iterador de origem (e libera a vaga no agendador) se o consumo parou antes
+        if hasattr(iterador, "aclose"):
+            await iterador.aclose()
+
+
+def registrar_tokens(operacao: str, prompt: str = "", resposta: str = ""):
+    """Soma a estimativa de tokens do prompt e da resposta de uma chamada a um modelo."""
+    if prompt:
+        TOKENS.inc(max(1, len(prompt) // 4), operacao=operacao, tipo="prompt")
+    if resposta:
+        TOKENS.inc(max(1, len(resposta) // 4), operacao=operacao, tipo="resposta")
+
+
+_PARAMETRO_ROTA = re.compile(r"\{(\w+)(?::\w+)?\}")
+
+
+def _rota(scope) -> str:
+    """Caminho com os parâmetros no lugar dos valores (ex.: /rag/ingestoes/{job_id}),
+    para não criar uma série por ID. Requisições sem rota correspondente são agrupadas."""
+    route = scope.get("route")
+    if route is None:
+        return "desconhecida"
+    rota = route.path
+    # Versões recentes do FastAPI guardam na rota o caminho sem o prefixo do router:
+    # o prefixo (estático) é o que sobra do caminho requisitado antes da rota preenchida
+    parametros = scope.get("path_params", {})
+    preenchida = _PARAMETRO_ROTA.sub(lambda m: str(parametros.get(m.group(1), m.group(0))), rota)
+    caminho = scope["path"]
+    if caminho != preenchida and caminho.endswith(preenchida):
+        return caminho[: len(caminho) - len(preenchida)] + rota
+    return rota
+
+
+class MiddlewareMetricas:
+    """Middleware ASGI que mede cada requisição até o último byte da resposta (inclusive
+    nos streams SSE) e, se habilitado, registra o trace com as etapas em log JSON."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = {"id": uuid.uuid4().hex[:16], "etapas": []}
+        token = _trace_atual.set(trace)
+        status = 500
+        inicio = time.perf_counter()
+
+        async def enviar(mensagem):
+            nonlocal status
+            if mensagem["type"] == "http.response.start":
+                status = mensagem["status"]
+            await send(mensagem)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            _trace_atual.reset(token)
+            duracao = time.perf_counter() - inicio
+            rota = _rota(scope)
+            HTTP_DURACAO.observar(duracao, metodo=scope["method"], rota=rota, status=status)
+            if METRICAS_TRACE_LOGS:
+                logger.info(json.dumps({
+                    "trace_id": trace["id"],
+                    "metodo": scope["method"],
+                    "rota": rota,
+                    "status": status,
+                    "ms": round(duracao * 1000, 2),
+                    "etapas": trace["etapas"],
+                }, ensure_ascii=False))
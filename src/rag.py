@@ -1,35 +1,65 @@
 import os
 import shutil
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from pydantic import BaseModel
+import asyncio
+import hashlib
+import functools
+import numpy as np
+from collections import OrderedDict
+from fastapi import APIRouter, UploadFile, File, HTTPException, Form
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from .execucao import executar
+from . import agendador
+from .agendador import ErroUpstream, PRIORIDADE_INGESTAO
+from .sse import formatar_evento, com_heartbeat, SSE_HEADERS
+from . import recursos, ingestao, metricas
+from .cache import CacheLRU
+from .recuperacao import fundir_rrf, montar_contexto
+from .colecoes import RegistroColecoes, Colecao, NOME_COLECAO
 
 # --- Importações do Langchain, ChromaDB e Google ---
-import chromadb
-from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
-from langchain_chroma import Chroma
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader, UnstructuredPowerPointLoader
-from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_core.prompts import ChatPromptTemplate
-from langchain.chains import create_retrieval_chain
+# São importados apenas quando usados (na criação dos recursos, no aquecimento em segundo
+# plano), para que a API suba em poucos milissegundos e comece a responder às sondas.
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
 
 # --- Configuração do Roteador ---
 router = APIRouter()
 
 # --- Configuração da API Key ---
-try:
-    gemini_api_key = os.environ["GEMINI_API_KEY"]
-except KeyError:
-    raise EnvironmentError("A variável de ambiente GEMINI_API_KEY não foi encontrada. Configure sua API key.")
+# Verificada apenas ao criar os modelos do Gemini, para que o módulo possa ser importado
+# sem a chave (ex.: benchmark com serviços falsos registrados em `recursos`).
+gemini_api_key = os.environ.get("GEMINI_API_KEY")
+
+def _exigir_api_key() -> str:
+    if not gemini_api_key:
+        raise EnvironmentError("A variável de ambiente GEMINI_API_KEY não foi encontrada. Configure sua API key.")
+    return gemini_api_key
 
 # --- Constantes e Configurações Globais ---
-CHROMA_PERSIST_DIR = "chroma_db_persistent"
+CHROMA_PERSIST_DIR = os.environ.get("CHROMA_PERSIST_DIR", "chroma_db_persistent")
 CHROMA_COLLECTION_NAME = "ufsc_hackathon_rag"
-TEMP_UPLOAD_DIR = "temp_uploads"
+TEMP_UPLOAD_DIR = os.environ.get("TEMP_UPLOAD_DIR", "temp_uploads")
+EMBEDDING_MODEL_NAME = "models/embedding-001"
+INGESTAO_LOTE_EMBEDDINGS = int(os.environ.get("INGESTAO_LOTE_EMBEDDINGS", "64"))
+INGESTAO_EMBEDDINGS_PARALELOS = int(os.environ.get("INGESTAO_EMBEDDINGS_PARALELOS", "4"))
+RAG_CACHE_SIMILARIDADE = float(os.environ.get("RAG_CACHE_SIMILARIDADE", "0.95"))
+RAG_CACHE_MAX_ITENS = int(os.environ.get("RAG_CACHE_MAX_ITENS", "1000"))
+RAG_CACHE_TTL_SEGUNDOS = float(os.environ.get("RAG_CACHE_TTL_SEGUNDOS", str(24 * 3600)))
+RAG_K_DENSO = int(os.environ.get("RAG_K_DENSO", "10"))
+RAG_K_LEXICO = int(os.environ.get("RAG_K_LEXICO", "10"))
+RAG_ORCAMENTO_TOKENS = int(os.environ.get("RAG_ORCAMENTO_TOKENS", "1500"))
+RAG_LIMIAR_DUPLICADO = float(os.environ.get("RAG_LIMIAR_DUPLICADO", "0.6"))
+EMBEDDINGS_CACHE_DIR = os.environ.get("EMBEDDINGS_CACHE_DIR", os.path.join(CHROMA_PERSIST_DIR, "embeddings_cache"))
 
 # --- Modelos de Dados (Pydantic) ---
 class QueryRequest(BaseModel):
     question: str
+    # Coleção (curso ou usuário) consultada; cada uma tem documentos e busca independentes
+    colecao: str = Field(CHROMA_COLLECTION_NAME, pattern=NOME_COLECAO.pattern)
+    # Restringe a busca a estes documentos da coleção (nomes de arquivo)
+    sources: list[str] | None = None
 
 class SourceDocument(BaseModel):
     source: str
@@ -42,94 +72,99 @@ class QueryResponse(BaseModel):
 class UploadResponse(BaseModel):
     message: str
     filename: str
+    colecao: str
+    job_id: str
 
-# --- Inicialização do Cliente ChromaDB e Embeddings ---
-# Garante que o diretório de persistência exista
-os.makedirs(CHROMA_PERSIST_DIR, exist_ok=True)
+class IngestaoResponse(BaseModel):
+    id: str
+    filename: str
+    colecao: str
+    status: str
+    paginas_total: int | None
+    paginas_processadas: int
+    chunks_total: int
+    chunks_vetorizados: int
+    chunks_reaproveitados: int
+    chunks_removidos: int
+    erro: str | None
+
+class ColecaoRequest(BaseModel):
+    nome: str = Field(pattern=NOME_COLECAO.pattern)
+
+class ColecaoResponse(BaseModel):
+    nome: str
+    chunks: int
+
+class DocumentoColecao(BaseModel):
+    source: str
+    chunks: int
 
-# Cliente ChromaDB persistente para garantir que os dados sejam salvos localmente
-persistent_client = chromadb.PersistentClient(path=CHROMA_PERSIST_DIR)
+# --- Inicialização do Cliente ChromaDB e Embeddings ---
+def _criar_cliente_chroma():
+    import chromadb
+    # Garante que o diretório de persistência exista
+    os.makedirs(CHROMA_PERSIST_DIR, exist_ok=True)
+    # Cliente ChromaDB persistente para garantir que os dados sejam salvos localmente
+    return chromadb.PersistentClient(path=CHROMA_PERSIST_DIR)
+
+recursos.registrar("chroma_client", _criar_cliente_chroma)
+
+class EmbeddingsComCache:
+    """Envolve o modelo de embeddings com um cache persistente indexado pelo hash do texto
+    do chunk, para que um mesmo trecho (mesmo em documentos diferentes) nunca seja
+    vetorizado duas vezes. O modelo em si vem do registro de recursos (`recurso`).
+    Implementa a interface `Embeddings` do LangChain."""
+
+    def __init__(self, recurso: str, nome_modelo: str, cache: CacheLRU):
+        self.recurso = recurso
+        self.nome_modelo = nome_modelo
+        self.cache = cache
+
+    @property
+    def modelo(self):
+        return recursos.obter(self.recurso)
+
+    def _chave(self, texto: str) -> str:
+        return hashlib.sha256(f"{self.nome_modelo}:{texto}".encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        chaves = [self._chave(texto) for texto in texts]
+        vetores = [self.cache.get(chave) for chave in chaves]
+        faltantes = {}
+        for chave, texto, vetor in zip(chaves, texts, vetores):
+            if vetor is None:
+                faltantes.setdefault(chave, texto)
+        if faltantes:
+            metricas.registrar_tokens("embeddings_documentos", "".join(faltantes.values()))
+            novos = dict(zip(faltantes, self.modelo.embed_documents(list(faltantes.values()))))
+            self.cache.set_muitos(novos)
+            vetores = [vetor if vetor is not None else novos[chave] for chave, vetor in zip(chaves, vetores)]
+        return vetores
+
+    def embed_query(self, text: str) -> list[float]:
+        metricas.registrar_tokens("embeddings_pergunta", text)
+        return self.modelo.embed_query(text)
+
+
+def _criar_modelo_embeddings():
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    return GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL_NAME, google_api_key=_exigir_api_key())
+
+recursos.registrar("rag_embeddings", _criar_modelo_embeddings)
 
 # Modelo de embeddings que será usado tanto para armazenar quanto para consultar
-embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=gemini_api_key)
-
-# Instância principal do Chroma que será usada pela aplicação
-vector_store = Chroma(
-    client=persistent_client,
-    collection_name=CHROMA_COLLECTION_NAME,
-    embedding_function=embeddings,
+embeddings = EmbeddingsComCache(
+    "rag_embeddings",
+    EMBEDDING_MODEL_NAME,
+    CacheLRU("embeddings", max_itens=4096, diretorio_disco=EMBEDDINGS_CACHE_DIR, max_itens_disco=1_000_000),
 )
 
-# --- Lógica da Aplicação ---
-def process_and_store_document(filepath: str, original_filename: str):
-    """Carrega, processa e armazena o documento no ChromaDB, garantindo que não haja duplicatas."""
-    
-    # 1. Buscar os documentos existentes com base no nome do arquivo no metadado.
-    existing_docs = vector_store.get(where={"source": original_filename})
-    
-    # 2. Se a busca retornar IDs, significa que o documento já existe e precisa ser removido antes de adicionar a nova versão.
-    if existing_docs and existing_docs["ids"]:
-        vector_store.delete(ids=existing_docs["ids"])
-
-    # 3. Carregar e processar o novo documento.
-    if original_filename.endswith(".pdf"):
-        loader = PyPDFLoader(filepath)
-    elif original_filename.endswith((".pptx", ".ppt")):
-        loader = UnstructuredPowerPointLoader(filepath)
-    else:
-        raise HTTPException(status_code=400, detail="Formato de arquivo não suportado. Use PDF ou PPTX.")
-
-    documents = loader.load()
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-    docs = text_splitter.split_documents(documents)
-
-    # 4. Adicionar metadados a cada chunk para rastrear a origem.
-    for doc in docs:
-        doc.metadata = {"source": original_filename}
-
-    # 5. Adicionar os novos chunks processados ao banco de dados.
-    vector_store.add_documents(docs)
-
+# Coleções do Chroma (uma por curso ou usuário), cada uma com seu índice léxico (BM25)
+# para a recuperação híbrida e seu marcador de versão para o cache de respostas
+colecoes = RegistroColecoes(lambda: recursos.obter("chroma_client"), embeddings, CHROMA_PERSIST_DIR)
 
-# --- Endpoints da API de RAG ---
-@router.post("/upload", response_model=UploadResponse, summary="Upload de Documento")
-async def upload_document(file: UploadFile = File(...)):
-    if not os.path.exists(TEMP_UPLOAD_DIR):
-        os.makedirs(TEMP_UPLOAD_DIR)
-
-    temp_filepath = os.path.join(TEMP_UPLOAD_DIR, file.filename)
-
-    try:
-        with open(temp_filepath, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        process_and_store_document(temp_filepath, file.filename)
-
-    except Exception as e:
-        # Fornece um erro mais detalhado em caso de falha
-        raise HTTPException(status_code=500, detail=f"Erro ao processar o arquivo: {str(e)}")
-    finally:
-        # Garante que o arquivo temporário seja sempre removido
-        if os.path.exists(temp_filepath):
-            os.remove(temp_filepath)
-
-    return {"message": "Arquivo processado e armazenado com sucesso.", "filename": file.filename}
-
-
-@router.post("/query", response_model=QueryResponse, summary="Consulta sobre Documentos")
-async def query_documents(request: QueryRequest):
-    # Verifica se a coleção no ChromaDB contém documentos
-    if vector_store._collection.count() == 0:
-         raise HTTPException(status_code=404, detail="Nenhum documento foi enviado ainda. Faça o upload primeiro.")
-
-    # O vector_store já está inicializado, então criamos o retriever diretamente
-    retriever = vector_store.as_retriever(search_kwargs={"k": 5})
-
-    # Modelo de linguagem para gerar as respostas
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-pro", temperature=0.3, google_api_key=gemini_api_key)
-
-    # Template do prompt para guiar o modelo
-    prompt_template = ChatPromptTemplate.from_template("""
+# --- Template do Prompt do Tutor ---
+PROMPT_TUTOR_RAG = """
     Persona: Você é um tutor de IA, amigável e didático. Sua única função é ensinar usando estritamente o conteúdo dos documentos fornecidos.
 
     Regra Principal: Sua única fonte de verdade é o material fornecido no "Contexto". Não use nenhum conhecimento externo. Se a resposta não estiver no material, diga isso claramente.
@@ -172,22 +207,485 @@ async def query_documents(request: QueryRequest):
     {input}
 
     Sua resposta em HTML:
-    """)
+    """
+
+# --- Modelo de Linguagem e Cadeia de Recuperação (construídos uma única vez) ---
+def _criar_llm():
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(model="gemini-2.5-pro", temperature=0.3, google_api_key=_exigir_api_key())
+
+def _criar_document_chain():
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+    from langchain_core.prompts import ChatPromptTemplate
+    prompt_template = ChatPromptTemplate.from_template(PROMPT_TUTOR_RAG)
+    return create_stuff_documents_chain(recursos.obter("rag_llm"), prompt_template)
+
+recursos.registrar("rag_llm", _criar_llm)
+recursos.registrar("rag_document_chain", _criar_document_chain)
+
+# Executadas no pool do Gemini: a cadeia é obtida ali, pois construí-la é bloqueante
+def _gerar_resposta(entrada: dict) -> str:
+    return recursos.obter("rag_document_chain").invoke(entrada)
+
+def _gerar_resposta_stream(entrada: dict):
+    return recursos.obter("rag_document_chain").stream(entrada)
+
+# --- Cache Semântico de Respostas ---
+CACHE_SIMILARES = metricas.Contador(
+    "cache_respostas_similares_total", "Respostas do RAG servidas por uma pergunta semelhante já respondida."
+)
+
+class CacheRespostas:
+    """Guarda respostas de /query por escopo (coleção, versão da coleção e filtro de
+    documentos). Procura primeiro a pergunta normalizada exata e depois perguntas
+    parecidas, comparando os embeddings por similaridade de cosseno com o limiar
+    RAG_CACHE_SIMILARIDADE."""
+
+    def __init__(self, max_itens: int, ttl_segundos: float, limiar: float, max_escopos: int = 64):
+        self.exatas = CacheLRU("respostas", max_itens=max_itens, ttl_segundos=ttl_segundos)
+        self.limiar = limiar
+        self.max_itens = max_itens
+        self.max_escopos = max_escopos
+        self._escopos: OrderedDict[str, tuple[list[np.ndarray], list[str]]] = OrderedDict()
+        self.hits_similares = 0
+
+    @staticmethod
+    def _normalizar(pergunta: str) -> str:
+        return " ".join(pergunta.casefold().split()).rstrip("?!. ")
+
+    def chave(self, pergunta: str, versao: str) -> str:
+        return hashlib.sha256(f"{versao}:{self._normalizar(pergunta)}".encode("utf-8")).hexdigest()
+
+    def _entradas(self, versao: str) -> tuple[list[np.ndarray], list[str]]:
+        entradas = self._escopos.get(versao)
+        if entradas is None:
+            entradas = self._escopos[versao] = ([], [])
+            # Escopos antigos (versões superadas, coleções pouco usadas) são descartados
+            while len(self._escopos) > self.max_escopos:
+                self._escopos.popitem(last=False)
+        self._escopos.move_to_end(versao)
+        return entradas
+
+    def buscar_exata(self, pergunta: str, versao: str) -> dict | None:
+        return self.exatas.get(self.chave(pergunta, versao))
+
+    def buscar_similar(self, pergunta: str, vetor: list[float], versao: str) -> dict | None:
+        vetores, chaves = self._entradas(versao)
+        if not vetores:
+            return None
+        consulta = np.asarray(vetor, dtype=np.float32)
+        consulta /= np.linalg.norm(consulta) or 1.0
+        similaridades = np.stack(vetores) @ consulta
+        melhor = int(np.argmax(similaridades))
+        if similaridades[melhor] < self.limiar:
+            return None
+        resposta = self.exatas.get(chaves[melhor])
+        if resposta is not None:
+            self.hits_similares += 1
+            CACHE_SIMILARES.inc()
+            # A forma exata desta pergunta também passa a ser atendida direto pelo cache
+            self.exatas.set(self.chave(pergunta, versao), resposta)
+        return resposta
+
+    def guardar(self, pergunta: str, vetor: list[float], versao: str, resposta: dict):
+        vetores, chaves = self._entradas(versao)
+        chave = self.chave(pergunta, versao)
+        self.exatas.set(chave, resposta)
+        normalizado = np.asarray(vetor, dtype=np.float32)
+        normalizado /= np.linalg.norm(normalizado) or 1.0
+        vetores.append(normalizado)
+        chaves.append(chave)
+        if len(vetores) > self.max_itens:
+            del vetores[0]
+            del chaves[0]
+
+
+respostas_cache = CacheRespostas(RAG_CACHE_MAX_ITENS, RAG_CACHE_TTL_SEGUNDOS, RAG_CACHE_SIMILARIDADE)
+
+# --- Lógica da Aplicação ---
+def _id_chunk(source: str, chunk_hash: str, ocorrencia: int) -> str:
+    """Id determinístico de um chunk: mesmo documento + mesmo texto = mesmo id."""
+    return hashlib.sha256(f"{source}:{chunk_hash}:{ocorrencia}".encode("utf-8")).hexdigest()
+
+
+@functools.cache
+def _divisor_de_texto():
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+
+
+def _dividir_paginas(textos: list[str]) -> list[tuple[str, "Document"]]:
+    """Divide as páginas em chunks e calcula o hash de cada um. Executada no pool de
+    ingestão: a importação do LangChain e a divisão são CPU-bound e travariam o event loop."""
+    from langchain_core.documents import Document
+    chunks = _divisor_de_texto().split_documents([Document(page_content=texto) for texto in textos])
+    return [(hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest(), doc) for doc in chunks]
 
-    # Criação da cadeia de documentos e da cadeia de recuperação
-    document_chain = create_stuff_documents_chain(llm, prompt_template)
-    retrieval_chain = create_retrieval_chain(retriever, document_chain)
 
-    # Invocação da cadeia para obter a resposta
-    response = retrieval_chain.invoke({"input": request.question})
+async def process_and_store_document(filepath: str, original_filename: str, job: ingestao.JobIngestao, colecao: Colecao):
+    """Carrega, processa e armazena o documento no ChromaDB de forma incremental e em fluxo:
+    as páginas são lidas em lotes, divididas em chunks, e apenas os chunks novos ou
+    alterados são vetorizados e gravados em lotes; ao final, os que sumiram são removidos.
+    O progresso é registrado em `job`, que também permite o cancelamento."""
+    vector_store = colecao.vector_store
+    formato = ingestao.formato_do_arquivo(original_filename)
+    if formato is None:
+        raise HTTPException(status_code=400, detail="Formato de arquivo não suportado. Use PDF ou PPTX.")
+
+    # 1. Buscar os ids dos chunks já armazenados para este arquivo.
+    existing_docs = await executar("chroma", vector_store.get, where={"source": original_filename}, include=[])
+    existing_ids = set(existing_docs["ids"]) if existing_docs else set()
+
+    ids_atuais = set()
+    ocorrencias = {}
+    pendentes = []
+    gravacoes = []
+    gravando = set()
+    semaforo = asyncio.Semaphore(INGESTAO_EMBEDDINGS_PARALELOS)
+
+    async def gravar(lote):
+        try:
+            textos = [doc.page_content for _, doc in lote]
+            with metricas.etapa("ingestao", "embeddings"):
+                vetores = await agendador.chamar("embeddings", embeddings.embed_documents, textos, prioridade=PRIORIDADE_INGESTAO)
+            job.verificar_cancelamento()
+            gravando.add(asyncio.current_task())
+            with metricas.etapa("ingestao", "gravacao"):
+                await executar(
+                    "chroma",
+                    vector_store._collection.upsert,
+                    ids=[chunk_id for chunk_id, _ in lote],
+                    embeddings=vetores,
+                    documents=textos,
+                    metadatas=[doc.metadata for _, doc in lote],
+                )
+                await executar("chroma", colecao.indice_lexico.adicionar, [chunk_id for chunk_id, _ in lote], textos, [original_filename] * len(lote))
+                await executar("chroma", colecao.invalidar)
+            job.chunks_vetorizados += len(lote)
+        finally:
+            semaforo.release()
+
+    async def despachar(lote):
+        # Aguarda uma vaga: limita os lotes em voo e, com eles, a memória usada
+        await semaforo.acquire()
+        for gravacao in gravacoes:
+            if gravacao.done() and gravacao.exception():
+                semaforo.release()
+                raise gravacao.exception()
+        gravacoes.append(asyncio.create_task(gravar(lote)))
 
+    try:
+        job.paginas_total = await ingestao.contar_paginas(filepath, formato)
+
+        # 2. Ler as páginas em lotes, dividir em chunks e atribuir ids determinísticos a partir
+        #    do hash do conteúdo. Trechos repetidos no mesmo documento são diferenciados pela
+        #    ordem de ocorrência.
+        extracao = metricas.Cronometro()
+        async for lote_paginas in ingestao.paginas(filepath, formato, job.paginas_total):
+            extracao.registrar("ingestao", "extracao_paginas")
+            job.verificar_cancelamento()
+            with metricas.etapa("ingestao", "divisao_chunks"):
+                chunks = await executar("ingestao", _dividir_paginas, [texto for _, texto in lote_paginas])
+            for chunk_hash, doc in chunks:
+                ocorrencia = ocorrencias.get(chunk_hash, 0)
+                ocorrencias[chunk_hash] = ocorrencia + 1
+                chunk_id = _id_chunk(original_filename, chunk_hash, ocorrencia)
+                # Metadados de cada chunk para rastrear a origem.
+                doc.metadata = {"source": original_filename, "chunk_hash": chunk_hash}
+                ids_atuais.add(chunk_id)
+                job.chunks_total += 1
+                if chunk_id in existing_ids:
+                    job.chunks_reaproveitados += 1
+                else:
+                    pendentes.append((chunk_id, doc))
+            job.paginas_processadas += len(lote_paginas)
+            metricas.PAGINAS_INGERIDAS.inc(len(lote_paginas), formato=formato)
+
+            # 3. Vetorizar e gravar os chunks novos em lotes de tamanho fixo.
+            while len(pendentes) >= INGESTAO_LOTE_EMBEDDINGS:
+                await despachar(pendentes[:INGESTAO_LOTE_EMBEDDINGS])
+                pendentes = pendentes[INGESTAO_LOTE_EMBEDDINGS:]
+            extracao.reiniciar()
+
+        if pendentes:
+            await despachar(pendentes)
+        await asyncio.gather(*gravacoes)
+    finally:
+        # Lotes ainda nos embeddings são descartados, mas as gravações já iniciadas (nas
+        # threads do ChromaDB) terminam antes de o job liberar o arquivo para o próximo,
+        # que compara os ids com o que ficou gravado
+        for gravacao in gravacoes:
+            if gravacao not in gravando:
+                gravacao.cancel()
+        await asyncio.gather(*gravacoes, return_exceptions=True)
+
+    # 4. Remover apenas os chunks que deixaram de existir no documento.
+    removidos = list(existing_ids - ids_atuais)
+    if removidos:
+        await executar("chroma", vector_store.delete, ids=removidos)
+        await executar("chroma", colecao.indice_lexico.remover, removidos)
+        await executar("chroma", colecao.invalidar)
+        job.chunks_removidos = len(removidos)
+
+
+def sincronizar_indices_lexicos():
+    """Alinha o índice BM25 de cada coleção existente com o conteúdo do ChromaDB."""
+    for nome in colecoes.nomes():
+        colecoes.obter(nome).sincronizar_indice_lexico()
+
+
+async def _recuperar(question: str, vetor: list[float], colecao: Colecao, sources: list[str] | None) -> list["Document"]:
+    """Busca híbrida: combina os rankings vetorial (ChromaDB) e léxico (BM25) por RRF,
+    remove sobreposições e quase-duplicatas e limita o contexto a RAG_ORCAMENTO_TOKENS.
+    Se `sources` for informado, apenas esses documentos da coleção são considerados."""
+    from langchain_core.documents import Document
+    with metricas.etapa("rag", "busca_densa"):
+        densos = await executar(
+            "chroma",
+            colecao.vector_store._collection.query,
+            query_embeddings=[vetor],
+            n_results=RAG_K_DENSO,
+            where={"source": {"$in": sources}} if sources else None,
+            include=["documents", "metadatas"],
+        )
+    ranking_denso = [
+        {"id": chunk_id, "source": (metadata or {}).get("source", "Fonte desconhecida"), "conteudo": conteudo}
+        for chunk_id, conteudo, metadata in zip(densos["ids"][0], densos["documents"][0], densos["metadatas"][0])
+    ]
+    with metricas.etapa("rag", "busca_lexica"):
+        ranking_lexico = await executar("chroma", colecao.indice_lexico.buscar, question, RAG_K_LEXICO, sources)
+
+    with metricas.etapa("rag", "montagem_contexto"):
+        # A deduplicação por sobreposição é CPU-bound: roda no pool, como as buscas acima
+        contexto = await executar(
+            "chroma",
+            lambda: montar_contexto(fundir_rrf([ranking_denso, ranking_lexico]), RAG_ORCAMENTO_TOKENS, RAG_LIMIAR_DUPLICADO),
+        )
+    return [Document(page_content=c["conteudo"], metadata={"source": c["source"]}) for c in contexto]
+
+
+def _texto_do_prompt(docs: list["Document"], question: str) -> str:
+    """Aproximação do prompt enviado ao Gemini, usada na estimativa de tokens."""
+    return PROMPT_TUTOR_RAG + question + "\n\n".join(doc.page_content for doc in docs)
+
+
+def _extrair_fontes(context_docs) -> list[SourceDocument]:
+    """Monta a lista de fontes a partir dos chunks recuperados, sem repetir documentos."""
     sources = []
-    if "context" in response and response["context"]:
-        for doc in response["context"]:
-            # Usamos um set para evitar adicionar a mesma fonte múltiplas vezes
-            source_name = doc.metadata.get("source", "Fonte desconhecida")
-            if source_name not in {s.source for s in sources}:
-                 sources.append(SourceDocument(source=source_name, content=doc.page_content))
+    for doc in context_docs or []:
+        # Usamos um set para evitar adicionar a mesma fonte múltiplas vezes
+        source_name = doc.metadata.get("source", "Fonte desconhecida")
+        if source_name not in {s.source for s in sources}:
+            sources.append(SourceDocument(source=source_name, content=doc.page_content))
+    return sources
+
+
+def _salvar_upload(file: UploadFile, destino: str):
+    """Copia o upload para o disco (operação bloqueante, executada fora do event loop)."""
+    with open(destino, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
+
+
+# --- Endpoints da API de RAG ---
+async def _obter_colecao(nome: str, criar: bool = False) -> Colecao:
+    """Resolve a coleção pelo nome, convertendo nome inválido em 400 e coleção inexistente em 404."""
+    try:
+        colecao = await executar("chroma", colecoes.obter, nome, criar)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if colecao is None:
+        raise HTTPException(status_code=404, detail=f"Coleção '{nome}' não encontrada.")
+    return colecao
+
+
+async def _ingerir(temp_filepath: str, original_filename: str, job: ingestao.JobIngestao, colecao: Colecao):
+    try:
+        async with ingestao.exclusivo(job):
+            # Pode ter sido substituído por um upload mais recente enquanto esperava a vez
+            job.verificar_cancelamento()
+            await process_and_store_document(temp_filepath, original_filename, job, colecao)
+    finally:
+        # Garante que o arquivo temporário seja sempre removido
+        if os.path.exists(temp_filepath):
+            os.remove(temp_filepath)
 
 
-    return {"answer": response["answer"], "sources": sources}
\ No newline at end of file
+@router.post("/upload", response_model=UploadResponse, status_code=202, summary="Upload de Documento")
+async def upload_document(file: UploadFile = File(...), colecao: str = Form(CHROMA_COLLECTION_NAME)):
+    """Recebe o arquivo e inicia o processamento em segundo plano na coleção informada
+    (criada se ainda não existir). O andamento pode ser acompanhado em /ingestoes/{job_id}."""
+    if ingestao.formato_do_arquivo(file.filename) is None:
+        raise HTTPException(status_code=400, detail="Formato de arquivo não suportado. Use PDF ou PPTX.")
+    destino = await _obter_colecao(colecao, criar=True)
+
+    if not os.path.exists(TEMP_UPLOAD_DIR):
+        os.makedirs(TEMP_UPLOAD_DIR)
+
+    job = ingestao.criar_job(file.filename, destino.nome)
+    # O id do job no nome evita que uploads simultâneos do mesmo arquivo se sobrescrevam
+    temp_filepath = os.path.join(TEMP_UPLOAD_DIR, f"{job.id}_{os.path.basename(file.filename)}")
+
+    try:
+        await executar("ingestao", _salvar_upload, file, temp_filepath)
+    except Exception as e:
+        job.status = "erro"
+        job.erro = str(e)
+        if os.path.exists(temp_filepath):
+            os.remove(temp_filepath)
+        # Fornece um erro mais detalhado em caso de falha
+        raise HTTPException(status_code=500, detail=f"Erro ao processar o arquivo: {str(e)}")
+
+    ingestao.agendar(job, _ingerir(temp_filepath, file.filename, job, destino))
+    return {
+        "message": "Arquivo recebido. O processamento continua em segundo plano.",
+        "filename": file.filename,
+        "colecao": destino.nome,
+        "job_id": job.id,
+    }
+
+
+@router.get("/ingestoes/{job_id}", response_model=IngestaoResponse, summary="Andamento do processamento de um documento")
+async def consultar_ingestao(job_id: str):
+    job = ingestao.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Processamento não encontrado.")
+    return job.para_dict()
+
+
+@router.delete("/ingestoes/{job_id}", response_model=IngestaoResponse, summary="Cancela o processamento de um documento")
+async def cancelar_ingestao(job_id: str):
+    """Interrompe o processamento. Chunks já gravados permanecem e são reaproveitados num novo upload."""
+    job = ingestao.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Processamento não encontrado.")
+    if job.em_andamento():
+        job.cancelado = True
+    return job.para_dict()
+
+
+async def _buscar_no_cache(question: str, colecao: Colecao, sources: list[str] | None):
+    """Consulta o cache de respostas da versão atual da coleção. Retorna (escopo, embedding
+    da pergunta, resposta); o embedding só é calculado se a pergunta exata não estiver em cache."""
+    versao = await executar("chroma", colecao.versao)
+    if sources:
+        versao += "|" + ",".join(sorted(sources))
+    resposta = respostas_cache.buscar_exata(question, versao)
+    if resposta is not None:
+        return versao, None, resposta
+    with metricas.etapa("rag", "embedding_pergunta"):
+        vetor = await agendador.chamar("embeddings", embeddings.embed_query, question, chave=question)
+    return versao, vetor, respostas_cache.buscar_similar(question, vetor, versao)
+
+
+@router.post("/query", response_model=QueryResponse, summary="Consulta sobre Documentos")
+async def query_documents(request: QueryRequest):
+    colecao = await _obter_colecao(request.colecao)
+    # Verifica se a coleção no ChromaDB contém documentos
+    if await executar("chroma", colecao.contar) == 0:
+         raise HTTPException(status_code=404, detail="Nenhum documento foi enviado ainda. Faça o upload primeiro.")
+
+    versao, vetor, resposta = await _buscar_no_cache(request.question, colecao, request.sources)
+    if resposta is not None:
+        return resposta
+
+    # Recupera os chunks mais relevantes reaproveitando o embedding da pergunta
+    docs = await _recuperar(request.question, vetor, colecao, request.sources)
+
+    # Perguntas idênticas feitas ao mesmo tempo compartilham uma única chamada ao Gemini
+    with metricas.etapa("rag", "geracao"):
+        answer = await agendador.chamar(
+            "gemini", _gerar_resposta, {"context": docs, "input": request.question},
+            chave=respostas_cache.chave(request.question, versao),
+        )
+    metricas.registrar_tokens("rag_resposta", _texto_do_prompt(docs, request.question), answer)
+
+    resposta = {"answer": answer, "sources": [s.model_dump() for s in _extrair_fontes(docs)]}
+    respostas_cache.guardar(request.question, vetor, versao, resposta)
+    return resposta
+
+
+@router.post("/query/stream", summary="Consulta sobre Documentos (streaming SSE)")
+async def query_documents_stream(request: QueryRequest):
+    """Versão em streaming de /query: envia primeiro as fontes recuperadas (evento `sources`),
+    depois os trechos da resposta conforme o Gemini os gera (eventos `token`) e, ao final,
+    a resposta completa (evento `fim`)."""
+    colecao = await _obter_colecao(request.colecao)
+    if await executar("chroma", colecao.contar) == 0:
+         raise HTTPException(status_code=404, detail="Nenhum documento foi enviado ainda. Faça o upload primeiro.")
+
+    async def eventos():
+        try:
+            versao, vetor, resposta = await _buscar_no_cache(request.question, colecao, request.sources)
+            if resposta is not None:
+                yield formatar_evento("sources", resposta["sources"])
+                yield formatar_evento("token", {"texto": resposta["answer"]})
+                yield formatar_evento("fim", {"answer": resposta["answer"]})
+                return
+
+            docs = await _recuperar(request.question, vetor, colecao, request.sources)
+            sources = [s.model_dump() for s in _extrair_fontes(docs)]
+            yield formatar_evento("sources", sources)
+
+            partes = []
+            geracao = agendador.iterar("gemini", _gerar_resposta_stream, {"context": docs, "input": request.question})
+            async for trecho in metricas.cronometrar("rag", "geracao", geracao):
+                if trecho:
+                    partes.append(trecho)
+                    yield formatar_evento("token", {"texto": trecho})
+            metricas.registrar_tokens("rag_resposta", _texto_do_prompt(docs, request.question), "".join(partes))
+        except ErroUpstream as e:
+            yield formatar_evento("erro", {"detail": str(e), "status_code": e.status_code, "retry_after": e.retry_after})
+            return
+        except Exception as e:
+            yield formatar_evento("erro", {"detail": f"Erro ao gerar a resposta: {str(e)}"})
+            return
+
+        answer = "".join(partes)
+        respostas_cache.guardar(request.question, vetor, versao, {"answer": answer, "sources": sources})
+        yield formatar_evento("fim", {"answer": answer})
+
+    return StreamingResponse(com_heartbeat(eventos()), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+# --- Endpoints de Gerenciamento de Coleções ---
+@router.get("/colecoes", response_model=list[ColecaoResponse], summary="Lista as coleções")
+async def listar_colecoes():
+    nomes = await executar("chroma", colecoes.nomes)
+    resultado = []
+    for nome in nomes:
+        colecao = await _obter_colecao(nome)
+        resultado.append({"nome": nome, "chunks": await executar("chroma", colecao.contar)})
+    return resultado
+
+
+@router.post("/colecoes", response_model=ColecaoResponse, status_code=201, summary="Cria uma coleção")
+async def criar_colecao(request: ColecaoRequest):
+    if request.nome in await executar("chroma", colecoes.nomes):
+        raise HTTPException(status_code=409, detail=f"A coleção '{request.nome}' já existe.")
+    colecao = await _obter_colecao(request.nome, criar=True)
+    return {"nome": colecao.nome, "chunks": 0}
+
+
+@router.delete("/colecoes/{nome}", summary="Exclui uma coleção e todos os seus documentos")
+async def excluir_colecao(nome: str):
+    # Interrompe ingestões ainda em andamento para a coleção
+    for job in ingestao.jobs.values():
+        if job.colecao == nome and job.em_andamento():
+            job.cancelado = True
+    if not await executar("chroma", colecoes.excluir, nome):
+        raise HTTPException(status_code=404, detail=f"Coleção '{nome}' não encontrada.")
+    return {"message": f"Coleção '{nome}' excluída."}
+
+
+@router.get("/colecoes/{nome}/documentos", response_model=list[DocumentoColecao], summary="Lista os documentos de uma coleção")
+async def listar_documentos(nome: str):
+    colecao = await _obter_colecao(nome)
+    return await executar("chroma", colecao.documentos)
+
+
+@router.delete("/colecoes/{nome}/documentos/{source}", summary="Remove um documento de uma coleção")
+async def remover_documento(nome: str, source: str):
+    colecao = await _obter_colecao(nome)
+    if await executar("chroma", colecao.remover_documento, source) == 0:
+        raise HTTPException(status_code=404, detail=f"Documento '{source}' não encontrado na coleção '{nome}'.")
+    return {"message": f"Documento '{source}' removido da coleção '{nome}'."}
@@ -0,0 +1,206 @@
+import re
+import math
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+
+# --- Recuperação Híbrida (Léxica + Vetorial) ---
+# A busca vetorial do ChromaDB é boa para paráfrases, mas falha em termos exatos como
+# nomes de fórmulas e siglas. Um índice BM25 local, mantido junto com a coleção, cobre
+# esses casos; os dois rankings são combinados por Reciprocal Rank Fusion (RRF) e o
+# contexto final é deduplicado e limitado a um orçamento de tokens.
+
+STOPWORDS = frozenset("""
+a ao aos as com como da das de del do dos e ela elas ele eles em entre era essa esse
+esta este eu foi for ha isso isto ja la lhe mais mas me mesmo na nao nas no nos num
+numa o os ou para pela pelas pelo pelos por qual quando que quem se sem ser seu sua
+sao tambem te tem ter um uma umas uns voce
+""".split())
+
+_PALAVRA = re.compile(r"\w+")
+
+
+def tokenizar(texto: str) -> list[str]:
+    """Minúsculas, sem acentos e sem stopwords; siglas e números são preservados."""
+    sem_acentos = unicodedata.normalize("NFKD", texto.casefold())
+    sem_acentos = "".join(c for c in sem_acentos if not unicodedata.combining(c))
+    return [t for t in _PALAVRA.findall(sem_acentos) if t not in STOPWORDS and (len(t) > 1 or t.isdigit())]
+
+
+class IndiceBM25:
+    """Índice invertido BM25 persistido em SQLite, atualizado a cada gravação na coleção."""
+
+    def __init__(self, caminho: str, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._db = sqlite3.connect(caminho, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS chunks (
+                    id TEXT PRIMARY KEY, source TEXT, conteudo TEXT NOT NULL, tamanho INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS termos (
+                    termo TEXT NOT NULL, chunk_id TEXT NOT NULL, tf INTEGER NOT NULL,
+                    PRIMARY KEY (termo, chunk_id)
+                );
+                CREATE INDEX IF NOT EXISTS termos_por_chunk ON termos (chunk_id);
+            """)
+            self._db.commit()
+
+    def contar(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def adicionar(self, ids: list[str], textos: list[str], sources: list[str]):
+        with self._lock:
+            self._remover(ids)
+            for chunk_id, texto, source in zip(ids, textos, sources):
+                termos = Counter(tokenizar(texto))
+                self._db.execute(
+                    "INSERT INTO chunks (id, source, conteudo, tamanho) VALUES (?, ?, ?, ?)",
+                    (chunk_id, source, texto, sum(termos.values())),
+                )
+                self._db.executemany(
+                    "INSERT INTO termos (termo, chunk_id, tf) VALUES (?, ?, ?)",
+                    [(termo, chunk_id, tf) for termo, tf in termos.items()],
+                )
+            self._db.commit()
+
+    def remover(self, ids: list[str]):
+        with self._lock:
+            self._remover(ids)
+            self._db.commit()
+
+    def limpar(self):
+        with self._lock:
+            self._db.execute("DELETE FROM termos")
+            self._db.execute("DELETE FROM chunks")
+            self._db.commit()
+
+    def _remover(self, ids: list[str]):
+        self._db.executemany("DELETE FROM termos WHERE chunk_id = ?", [(i,) for i in ids])
+        self._db.executemany("DELETE FROM chunks WHERE id = ?", [(i,) for i in ids])
+
+    def listar_sources(self) -> list[tuple[str, int]]:
+        """Documentos indexados e a quantidade de chunks de cada um."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT source, COUNT(*) FROM chunks GROUP BY source ORDER BY source"
+            ).fetchall()
+
+    def buscar(self, consulta: str, k: int, sources: list[str] | None = None) -> list[dict]:
+        """Retorna os `k` chunks de maior pontuação BM25 como dicts com id, source e conteúdo,
+        opcionalmente restritos aos documentos em `sources`."""
+        termos = set(tokenizar(consulta))
+        if not termos:
+            return []
+        filtro = ""
+        parametros = list(termos)
+        if sources:
+            filtro = f" AND c.source IN ({','.join('?' * len(sources))})"
+            parametros += list(sources)
+        with self._lock:
+            total, media = self._db.execute("SELECT COUNT(*), AVG(tamanho) FROM chunks").fetchone()
+            if not total:
+                return []
+            postings = self._db.execute(
+                f"SELECT t.termo, t.chunk_id, t.tf, c.tamanho FROM termos t JOIN chunks c ON c.id = t.chunk_id "
+                f"WHERE t.termo IN ({','.join('?' * len(termos))}){filtro}",
+                parametros,
+            ).fetchall()
+
+            # O df vem sempre da coleção inteira, coerente com `total`: com filtro de
+            # documentos, as postings acima não contam os chunks dos demais
+            if sources:
+                df = dict(self._db.execute(
+                    f"SELECT termo, COUNT(*) FROM termos WHERE termo IN ({','.join('?' * len(termos))}) GROUP BY termo",
+                    list(termos),
+                ).fetchall())
+            else:
+                df = Counter(termo for termo, _, _, _ in postings)
+            pontuacoes = Counter()
+            for termo, chunk_id, tf, tamanho in postings:
+                idf = math.log(1 + (total - df[termo] + 0.5) / (df[termo] + 0.5))
+                pontuacoes[chunk_id] += idf * tf * (self.k1 + 1) / (
+                    tf + self.k1 * (1 - self.b + self.b * tamanho / (media or 1))
+                )
+
+            melhores = pontuacoes.most_common(k)
+            if not melhores:
+                return []
+            linhas = self._db.execute(
+                f"SELECT id, source, conteudo FROM chunks WHERE id IN ({','.join('?' * len(melhores))})",
+                [chunk_id for chunk_id, _ in melhores],
+            ).fetchall()
+        por_id = {chunk_id: {"id": chunk_id, "source": source, "conteudo": conteudo} for chunk_id, source, conteudo in linhas}
+        return [por_id[chunk_id] for chunk_id, _ in melhores if chunk_id in por_id]
+
+
+# --- Fusão, Deduplicação e Montagem do Contexto ---
+def fundir_rrf(rankings: list[list[dict]], k: int = 60) -> list[dict]:
+    """Reciprocal Rank Fusion: cada lista contribui com 1 / (k + posição) para o item."""
+    pontuacoes = Counter()
+    itens = {}
+    for ranking in rankings:
+        for posicao, item in enumerate(ranking, start=1):
+            pontuacoes[item["id"]] += 1 / (k + posicao)
+            itens.setdefault(item["id"], item)
+    return [itens[chunk_id] for chunk_id, _ in pontuacoes.most_common()]
+
+
+def estimar_tokens(texto: str) -> int:
+    # Aproximação usual para português: ~4 caracteres por token
+    return max(1, len(texto) // 4)
+
+
+def _shingles(texto: str, n: int = 5) -> set:
+    palavras = tokenizar(texto)
+    return {tuple(palavras[i:i + n]) for i in range(max(1, len(palavras) - n + 1))}
+
+
+def _remover_sobreposicao(texto: str, anterior: str, minimo: int = 30, maximo: int = 400) -> str:
+    """Remove do início de `texto` o trecho que repete o final de `anterior` (chunk_overlap)
+    e do final de `texto` o trecho que repete o início de `anterior`."""
+    for tamanho in range(min(maximo, len(texto), len(anterior)), minimo - 1, -1):
+        if anterior.endswith(texto[:tamanho]):
+            texto = texto[tamanho:].lstrip()
+            break
+    for tamanho in range(min(maximo, len(texto), len(anterior)), minimo - 1, -1):
+        if anterior.startswith(texto[-tamanho:]):
+            texto = texto[:-tamanho].rstrip()
+            break
+    return texto
+
+
+def montar_contexto(candidatos: list[dict], orcamento_tokens: int, limiar_duplicado: float = 0.6) -> list[dict]:
+    """Percorre os candidatos na ordem da fusão, descarta quase-duplicatas (Jaccard de
+    shingles acima do limiar), corta sobreposições com chunks vizinhos do mesmo documento
+    e inclui trechos até esgotar o orçamento de tokens."""
+    selecionados = []
+    originais = []
+    shingles_selecionados = []
+    usados = 0
+    for candidato in candidatos:
+        texto = candidato["conteudo"]
+        for anterior in originais:
+            if anterior["source"] == candidato["source"]:
+                texto = _remover_sobreposicao(texto, anterior["conteudo"])
+        if not texto.strip():
+            continue
+
+        shingles = _shingles(texto)
+        if any(len(shingles & outro) / len(shingles | outro) >= limiar_duplicado for outro in shingles_selecionados):
+            continue
+
+        tokens = estimar_tokens(texto)
+        if selecionados and usados + tokens > orcamento_tokens:
+            continue
+        selecionados.append({**candidato, "conteudo": texto})
+        originais.append(candidato)
+        shingles_selecionados.append(shingles)
+        usados += tokens
+        if usados >= orcamento_tokens:
+            break
+    return selecionados
@@ -0,0 +1,73 @@
+import logging
+import threading
+
+# --- Registro de Recursos de Longa Duração ---
+# Clientes, modelos e cadeias que são caros de construir (canais gRPC, carregamento de
+# credenciais, montagem de cadeias do LangChain) são criados uma única vez e
+# reaproveitados por todas as requisições durante a vida da aplicação.
+
+logger = logging.getLogger(__name__)
+
+_fabricas = {}
+_instancias = {}
+# Um lock por recurso: construir um recurso lento (ex.: o cliente do Chroma) não bloqueia
+# quem precisa de outro já pronto, e a fábrica de um recurso pode obter outro (ex.: a
+# cadeia do RAG usa o LLM). `_lock` protege apenas o dicionário de locks.
+_locks: dict[str, threading.RLock] = {}
+_lock = threading.Lock()
+
+
+def _lock_do_recurso(nome: str) -> threading.RLock:
+    with _lock:
+        lock = _locks.get(nome)
+        if lock is None:
+            lock = _locks[nome] = threading.RLock()
+        return lock
+
+
+def registrar(nome: str, fabrica):
+    """Registra a função que constrói o recurso `nome` na primeira vez em que ele for usado.
+    Registrar de novo um nome descarta a instância já construída (ex.: serviços falsos
+    do benchmark substituindo os reais)."""
+    with _lock_do_recurso(nome):
+        _fabricas[nome] = fabrica
+        _instancias.pop(nome, None)
+
+
+def obter(nome: str):
+    """Retorna a instância compartilhada do recurso, construindo-a sob demanda. A primeira
+    chamada pode ser lenta (rede, credenciais): em código assíncrono, chame-a em uma
+    thread de trabalho, nunca direto no event loop."""
+    instancia = _instancias.get(nome)
+    if instancia is None:
+        with _lock_do_recurso(nome):
+            instancia = _instancias.get(nome)
+            if instancia is None:
+                instancia = _fabricas[nome]()
+                _instancias[nome] = instancia
+    return instancia
+
+
+def registrados() -> list[str]:
+    return list(_fabricas)
+
+
+def aquecer(nomes: list[str] | None = None) -> dict[str, str]:
+    """Constrói os recursos registrados (ou apenas `nomes`) e retorna as falhas, com a
+    mensagem de erro de cada uma. Falhas também são registradas em log e o recurso volta
+    a ser construído sob demanda na primeira requisição que precisar dele."""
+    falhas = {}
+    for nome in nomes if nomes is not None else list(_fabricas):
+        try:
+            obter(nome)
+        except Exception as e:
+            logger.exception("Falha ao aquecer o recurso '%s'", nome)
+            falhas[nome] = str(e) or type(e).__name__
+    return falhas
+
+
+def limpar():
+    """Descarta as instâncias construídas (usado no desligamento da aplicação)."""
+    for nome in list(_instancias):
+        with _lock_do_recurso(nome):
+            _instancias.pop(nome, None)
@@ -1,20 +1,41 @@
 import os
+import re
 import json
-import google.generativeai as genai
+import io
+import hashlib
 from fastapi import APIRouter, File, UploadFile, HTTPException, Form
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from google.cloud import vision
+from .execucao import executar
+from . import agendador
+from .agendador import ErroUpstream, PRIORIDADE_INTERATIVA
+from .sse import formatar_evento, com_heartbeat, SSE_HEADERS
+from . import recursos, metricas, relatorios
+from .cache import CacheLRU
+
+# Pillow é opcional: sem ele as imagens são enviadas ao Vision sem pré-processamento.
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Suporte opcional a fotos HEIC (padrão do iPhone)
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    pass
 
 # --- Configuração do Roteador ---
 # Mantemos o APIRouter para que o main.py possa importar e incluir as rotas.
 router = APIRouter()
 
 # --- Configurações de API e Variáveis de Ambiente ---
-try:
-    GEMINI_API_KEY = os.environ["GEMINI_API_KEY"]
-    genai.configure(api_key=GEMINI_API_KEY)
-except KeyError:
-    raise Exception("ERRO: Verifique se as variáveis de ambiente GEMINI_API_KEY e GOOGLE_APPLICATION_CREDENTIALS estão configuradas.")
+# A chave só é exigida quando o modelo é criado: sem ela a API ainda sobe (por exemplo,
+# no benchmark com serviços falsos), mas as correções falham com uma mensagem clara.
+# Os SDKs do Gemini e do Vision também só são importados ao criar os clientes, no
+# aquecimento em segundo plano, o que mantém a inicialização da API rápida.
+GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 
 # --- Modelos Pydantic para requisições de texto ---
 class TextoEnemRequest(BaseModel):
@@ -125,70 +146,291 @@ Você é um avaliador da banca de redação do vestibular da UFSC (Coperve), com
 **A proposta para esta redação é: Gênero Textual = {genero_textual}. A redação do aluno para análise segue abaixo:**
 """
 
+# --- Recursos Compartilhados ---
+# O modelo do Gemini e o cliente do Vision (com seus canais gRPC) são criados uma
+# única vez pelo registro de recursos e reaproveitados em todas as correções.
+GEMINI_MODEL_NAME = "gemini-2.5-pro"
+GEMINI_GENERATION_CONFIG = {"response_mime_type": "application/json", "temperature": 0.2}
+
+def _criar_modelo_correcao():
+    if not GEMINI_API_KEY:
+        raise EnvironmentError("ERRO: Verifique se as variáveis de ambiente GEMINI_API_KEY e GOOGLE_APPLICATION_CREDENTIALS estão configuradas.")
+    import google.generativeai as genai
+    genai.configure(api_key=GEMINI_API_KEY)
+    return genai.GenerativeModel(
+        GEMINI_MODEL_NAME,
+        generation_config=genai.GenerationConfig(**GEMINI_GENERATION_CONFIG),
+    )
+
+def _criar_cliente_vision():
+    from google.cloud import vision
+    return vision.ImageAnnotatorClient()
+
+recursos.registrar("gemini_correcao", _criar_modelo_correcao)
+recursos.registrar("vision_client", _criar_cliente_vision)
+
+# Novas chamadas ao Gemini, pedindo apenas as seções faltantes, quando a resposta vem
+# incompleta ou com itens inválidos (bem mais baratas que regerar a correção inteira)
+CORRECAO_TENTATIVAS_PARCIAIS = int(os.environ.get("CORRECAO_TENTATIVAS_PARCIAIS", "2"))
+
+# --- Cache de Correções ---
+# Reenvios do mesmo texto (atualização da página, reabertura do histórico) reaproveitam
+# a correção anterior. A chave inclui o tipo de prova, o gênero, o texto normalizado,
+# a versão do prompt e a configuração do modelo, então qualquer mudança em prompt ou
+# modelo invalida naturalmente as entradas antigas.
+correcao_cache = CacheLRU(
+    "correcoes",
+    max_itens=int(os.environ.get("CORRECAO_CACHE_MAX_ITENS", "1024")),
+    ttl_segundos=float(os.environ.get("CORRECAO_CACHE_TTL_SEGUNDOS", str(7 * 24 * 3600))),
+    diretorio_disco=os.environ.get("CORRECAO_CACHE_DIR") or None,
+    max_itens_disco=int(os.environ.get("CORRECAO_CACHE_MAX_ITENS_DISCO", "100000")),
+)
+
+# --- Cache e Pré-processamento de OCR ---
+# A mesma foto costuma ser enviada para os dois corretores (ENEM e UFSC); o texto
+# extraído é guardado pelo hash do conteúdo da imagem e o Vision só é chamado uma vez.
+OCR_MAX_LADO = int(os.environ.get("OCR_MAX_LADO", "2048"))
+OCR_QUALIDADE_JPEG = int(os.environ.get("OCR_QUALIDADE_JPEG", "85"))
+
+ocr_cache = CacheLRU(
+    "ocr",
+    max_itens=int(os.environ.get("OCR_CACHE_MAX_ITENS", "1024")),
+    ttl_segundos=float(os.environ.get("OCR_CACHE_TTL_SEGUNDOS", str(7 * 24 * 3600))),
+    diretorio_disco=os.environ.get("CORRECAO_CACHE_DIR") or None,
+)
+
+def _hash(texto: str) -> str:
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+_ESPACOS = re.compile(r"[ \t\f\v]+")
+_LINHAS_EM_BRANCO = re.compile(r"\n{3,}")
+
+def _normalizar(texto: str) -> str:
+    """Normaliza quebras de linha (CRLF), espaços repetidos dentro de cada linha e espaços
+    no fim das linhas, para que reenvios equivalentes tenham a mesma chave. A divisão em
+    parágrafos é mantida: ela conta na nota de coesão e estrutura do texto."""
+    linhas = texto.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    texto = "\n".join(_ESPACOS.sub(" ", linha).strip() for linha in linhas)
+    return _LINHAS_EM_BRANCO.sub("\n\n", texto).strip()
+
+def chave_correcao(tipo: str, texto: str, genero: str | None = None) -> str:
+    """Chave de cache de uma correção, derivada do conteúdo e da versão do prompt/modelo."""
+    prompt = PROMPT_ENEM_CORRECTOR if tipo == "enem" else PROMPT_UFSC_CORRECTOR
+    componentes = {
+        "tipo": tipo,
+        "genero": _normalizar(genero).casefold() if genero else None,
+        "texto": _normalizar(texto),
+        "prompt": _hash(prompt),
+        "modelo": GEMINI_MODEL_NAME,
+        "config": GEMINI_GENERATION_CONFIG,
+        "esquema": relatorios.VERSAO_ESQUEMA,
+    }
+    return _hash(json.dumps(componentes, sort_keys=True, ensure_ascii=False))
+
+def montar_prompt(tipo: str, texto: str, genero: str | None = None) -> str:
+    if tipo == "enem":
+        return f"{PROMPT_ENEM_CORRECTOR}\n\n{texto}"
+    return PROMPT_UFSC_CORRECTOR.format(genero_textual=genero) + "\n\n" + texto
+
 # --- Funções Auxiliares ---
 
+def _detectar_texto(conteudo: bytes):
+    """Chamada síncrona ao Vision, executada no pool de threads do serviço."""
+    from google.cloud import vision
+    client = recursos.obter("vision_client")
+    return client.document_text_detection(image=vision.Image(content=conteudo))
+
+def preprocessar_imagem(conteudo: bytes) -> bytes:
+    """Reduz a foto para OCR: corrige a rotação EXIF, converte para tons de cinza,
+    limita o maior lado a OCR_MAX_LADO pixels e recomprime em JPEG. Se o resultado
+    não ficar menor que o original (ou a imagem não puder ser lida), devolve o original,
+    exceto fotos HEIC/HEIF, que o Vision não aceita e são sempre convertidas."""
+    if Image is None:
+        return conteudo
+    try:
+        with Image.open(io.BytesIO(conteudo)) as imagem:
+            heic = (imagem.format or "").upper() in ("HEIF", "HEIC", "AVIF")
+            imagem = ImageOps.exif_transpose(imagem).convert("L")
+            imagem.thumbnail((OCR_MAX_LADO, OCR_MAX_LADO))
+            saida = io.BytesIO()
+            imagem.save(saida, format="JPEG", quality=OCR_QUALIDADE_JPEG, optimize=True)
+    except Exception:
+        return conteudo
+    reduzido = saida.getvalue()
+    return reduzido if heic or len(reduzido) < len(conteudo) else conteudo
+
+async def extrair_texto_bytes(conteudo: bytes, prioridade: int = PRIORIDADE_INTERATIVA) -> str:
+    """Extrai o texto de uma imagem já lida, consultando antes o cache de OCR. A mesma
+    foto enviada ao mesmo tempo para os dois corretores gera uma única chamada ao Vision."""
+    chave = hashlib.sha256(f"{OCR_MAX_LADO}:{OCR_QUALIDADE_JPEG}:".encode() + conteudo).hexdigest()
+    texto_extraido = await ocr_cache.aget(chave)
+    if texto_extraido is not None:
+        return texto_extraido
+
+    with metricas.etapa("redacao", "preprocessamento"):
+        conteudo_ocr = await executar("imagem", preprocessar_imagem, conteudo)
+    with metricas.etapa("redacao", "ocr"):
+        response = await agendador.chamar(
+            "vision", _detectar_texto, conteudo_ocr, prioridade=prioridade, chave=chave
+        )
+    if response.error.message:
+        raise HTTPException(status_code=500, detail=f"Erro na API do Vision: {response.error.message}")
+
+    texto_extraido = response.full_text_annotation.text
+    if not texto_extraido:
+        raise HTTPException(status_code=400, detail="Nenhum texto detectado na imagem.")
+
+    await ocr_cache.aset(chave, texto_extraido)
+    return texto_extraido
+
 async def extrair_texto_imagem(foto: UploadFile):
     """Função auxiliar para extrair texto de uma imagem usando a API do Vision."""
     try:
-        client = vision.ImageAnnotatorClient()
-        content = await foto.read()
-        image = vision.Image(content=content)
-
-        response = client.document_text_detection(image=image)
-        if response.error.message:
-            raise HTTPException(status_code=500, detail=f"Erro na API do Vision: {response.error.message}")
-
-        texto_extraido = response.full_text_annotation.text
-        if not texto_extraido:
-            raise HTTPException(status_code=400, detail="Nenhum texto detectado na imagem.")
-        
-        return texto_extraido
+        with metricas.etapa("redacao", "leitura_upload"):
+            content = await foto.read()
+        return await extrair_texto_bytes(content)
+    except ErroUpstream:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro no processamento da imagem: {str(e)}")
 
-async def gerar_correcao_gemini(prompt_completo: str):
-    """Função auxiliar para chamar a API do Gemini e processar a resposta."""
+def _gerar_conteudo(prompt: str, **kwargs):
+    """Chamada síncrona ao Gemini, executada no pool do serviço: o modelo também é obtido
+    ali, pois a primeira construção (credenciais, canal gRPC) é bloqueante."""
+    return recursos.obter("gemini_correcao").generate_content(prompt, **kwargs)
+
+async def gerar_correcao_gemini(prompt_completo: str, prioridade: int = PRIORIDADE_INTERATIVA, chave: str | None = None,
+                                operacao: str = "correcao") -> str:
+    """Função auxiliar para chamar a API do Gemini e retornar o texto da resposta. Correções
+    simultâneas com a mesma `chave` compartilham uma única chamada ao Gemini."""
     try:
-        model = genai.GenerativeModel('gemini-2.5-pro')
-        
-        gemini_response = model.generate_content(
-            prompt_completo,
-            generation_config=genai.GenerationConfig(
-                response_mime_type="application/json",
-                temperature=0.2
+        with metricas.etapa("redacao", "geracao"):
+            gemini_response = await agendador.chamar(
+                "gemini", _gerar_conteudo, prompt_completo, prioridade=prioridade, chave=chave
             )
-        )
-        
-        return json.loads(gemini_response.text)
+        metricas.registrar_tokens(operacao, prompt_completo, gemini_response.text)
+        return gemini_response.text
+    except ErroUpstream:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro na API do Gemini ou na análise da resposta: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erro na API do Gemini: {str(e)}")
+
+def _interpretar(resposta: str) -> tuple[dict, bool]:
+    try:
+        return relatorios.reparar_json(resposta)
+    except relatorios.ErroRelatorio:
+        # Nada aproveitável: todas as seções serão pedidas na tentativa parcial
+        return {}, True
+
+async def validar_correcao(tipo: str, resposta: str, texto: str, genero: str | None = None,
+                           prioridade: int = PRIORIDADE_INTERATIVA) -> dict:
+    """Converte a resposta do Gemini no relatório validado. JSON quase válido é reparado
+    localmente, a nota final é recalculada e, se faltarem competências/critérios (ou vierem
+    inválidos), apenas essas seções são pedidas de novo ao modelo."""
+    with metricas.etapa("redacao", "parse_json"):
+        dados, reparado = _interpretar(resposta)
+        relatorio, faltantes = relatorios.validar(tipo, dados)
+
+    tentativas = 0
+    while faltantes and tentativas < CORRECAO_TENTATIVAS_PARCIAIS:
+        tentativas += 1
+        with metricas.etapa("redacao", "prompt"):
+            prompt = montar_prompt(tipo, texto, genero) + relatorios.instrucao_parcial(tipo, faltantes)
+        resposta_parcial = await gerar_correcao_gemini(prompt, prioridade, operacao=f"correcao_{tipo}_parcial")
+        with metricas.etapa("redacao", "parse_json"):
+            dados, _ = _interpretar(resposta_parcial)
+            relatorio, faltantes = relatorios.combinar(tipo, relatorio, dados)
+
+    if faltantes:
+        metricas.RELATORIOS.inc(tipo=tipo, resultado="falha")
+        raise HTTPException(
+            status_code=502,
+            detail=f"O Gemini não retornou uma correção completa (seções faltantes: {', '.join(map(str, faltantes))}).",
+        )
+    resultado = "parcial" if tentativas else "reparado" if reparado else "valido"
+    metricas.RELATORIOS.inc(tipo=tipo, resultado=resultado)
+    return relatorio
+
+async def corrigir_redacao(tipo: str, texto: str, genero: str | None = None, prioridade: int = PRIORIDADE_INTERATIVA):
+    """Corrige a redação consultando antes o cache de correções."""
+    chave = chave_correcao(tipo, texto, genero)
+    resultado_json = await correcao_cache.aget(chave)
+    if resultado_json is None:
+        with metricas.etapa("redacao", "prompt"):
+            prompt = montar_prompt(tipo, texto, genero)
+        resposta = await gerar_correcao_gemini(prompt, prioridade, chave, f"correcao_{tipo}")
+        resultado_json = await validar_correcao(tipo, resposta, texto, genero, prioridade)
+        await correcao_cache.aset(chave, resultado_json)
+    return resultado_json
+
+async def corrigir_redacao_stream(tipo: str, texto: str, genero: str | None = None):
+    """Gera eventos SSE da correção: trechos do JSON conforme o Gemini os produz
+    (eventos `token`) e, ao final, o relatório validado (evento `resultado`)."""
+    chave = chave_correcao(tipo, texto, genero)
+    resultado_json = await correcao_cache.aget(chave)
+    if resultado_json is None:
+        partes = []
+        try:
+            with metricas.etapa("redacao", "prompt"):
+                prompt = montar_prompt(tipo, texto, genero)
+            geracao = agendador.iterar("gemini", _gerar_conteudo, prompt, stream=True)
+            async for chunk in metricas.cronometrar("redacao", "geracao", geracao):
+                partes.append(chunk.text)
+                yield formatar_evento("token", {"texto": chunk.text})
+            resposta = "".join(partes)
+            metricas.registrar_tokens(f"correcao_{tipo}", prompt, resposta)
+            resultado_json = await validar_correcao(tipo, resposta, texto, genero)
+        except ErroUpstream as e:
+            yield formatar_evento("erro", {"detail": str(e), "status_code": e.status_code, "retry_after": e.retry_after})
+            return
+        except HTTPException as e:
+            yield formatar_evento("erro", {"detail": e.detail, "status_code": e.status_code})
+            return
+        except Exception as e:
+            yield formatar_evento("erro", {"detail": f"Erro na API do Gemini ou na análise da resposta: {str(e)}"})
+            return
+        await correcao_cache.aset(chave, resultado_json)
+    yield formatar_evento("resultado", resultado_json)
+
+def _resposta_sse(eventos):
+    return StreamingResponse(com_heartbeat(eventos), media_type="text/event-stream", headers=SSE_HEADERS)
 
 # --- Endpoints para Upload de Imagem ---
 
-@router.post("/corrigir-redacao-enem/", summary="Corrige redação do ENEM via imagem")
+@router.post("/corrigir-redacao-enem/", summary="Corrige redação do ENEM via imagem", response_model=relatorios.RelatorioEnem)
 async def corrigir_redacao_enem(foto: UploadFile = File(...)):
     texto_extraido = await extrair_texto_imagem(foto)
-    prompt_completo = f"{PROMPT_ENEM_CORRECTOR}\n\n{texto_extraido}"
-    resultado_json = await gerar_correcao_gemini(prompt_completo)
-    return resultado_json
+    return await corrigir_redacao("enem", texto_extraido)
 
-@router.post("/corrigir-redacao-ufsc/", summary="Corrige redação da UFSC via imagem")
+@router.post("/corrigir-redacao-ufsc/", summary="Corrige redação da UFSC via imagem", response_model=relatorios.RelatorioUfsc)
 async def corrigir_redacao_ufsc(foto: UploadFile = File(...), genero: str = Form(...)):
     texto_extraido = await extrair_texto_imagem(foto)
-    prompt_completo = PROMPT_UFSC_CORRECTOR.format(genero_textual=genero) + "\n\n" + texto_extraido
-    resultado_json = await gerar_correcao_gemini(prompt_completo)
-    return resultado_json
+    return await corrigir_redacao("ufsc", texto_extraido, genero)
+
+@router.post("/corrigir-redacao-enem/stream", summary="Corrige redação do ENEM via imagem (streaming SSE)")
+async def corrigir_redacao_enem_stream(foto: UploadFile = File(...)):
+    texto_extraido = await extrair_texto_imagem(foto)
+    return _resposta_sse(corrigir_redacao_stream("enem", texto_extraido))
+
+@router.post("/corrigir-redacao-ufsc/stream", summary="Corrige redação da UFSC via imagem (streaming SSE)")
+async def corrigir_redacao_ufsc_stream(foto: UploadFile = File(...), genero: str = Form(...)):
+    texto_extraido = await extrair_texto_imagem(foto)
+    return _resposta_sse(corrigir_redacao_stream("ufsc", texto_extraido, genero))
 
 # --- Endpoints para Envio de Texto ---
 
-@router.post("/corrigir-texto-enem/", summary="Corrige redação do ENEM via texto")
+@router.post("/corrigir-texto-enem/", summary="Corrige redação do ENEM via texto", response_model=relatorios.RelatorioEnem)
 async def corrigir_texto_enem(request: TextoEnemRequest):
-    prompt_completo = f"{PROMPT_ENEM_CORRECTOR}\n\n{request.texto}"
-    resultado_json = await gerar_correcao_gemini(prompt_completo)
-    return resultado_json
+    return await corrigir_redacao("enem", request.texto)
 
-@router.post("/corrigir-texto-ufsc/", summary="Corrige redação da UFSC via texto")
+@router.post("/corrigir-texto-ufsc/", summary="Corrige redação da UFSC via texto", response_model=relatorios.RelatorioUfsc)
 async def corrigir_texto_ufsc(request: TextoUfscRequest):
-    prompt_completo = PROMPT_UFSC_CORRECTOR.format(genero_textual=request.genero) + "\n\n" + request.texto
-    resultado_json = await gerar_correcao_gemini(prompt_completo)
-    return resultado_json
\ No newline at end of file
+    return await corrigir_redacao("ufsc", request.texto, request.genero)
+
+@router.post("/corrigir-texto-enem/stream", summary="Corrige redação do ENEM via texto (streaming SSE)")
+async def corrigir_texto_enem_stream(request: TextoEnemRequest):
+    return _resposta_sse(corrigir_redacao_stream("enem", request.texto))
+
+@router.post("/corrigir-texto-ufsc/stream", summary="Corrige redação da UFSC via texto (streaming SSE)")
+async def corrigir_texto_ufsc_stream(request: TextoUfscRequest):
+    return _resposta_sse(corrigir_redacao_stream("ufsc", request.texto, request.genero))
@@ -0,0 +1,205 @@
+import re
+import json
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+# --- Relatórios de Correção ---
+# Modelos tipados dos relatórios do ENEM e da UFSC e o tratamento da resposta do Gemini:
+# um reparo local para JSON quase válido (cercas de markdown, vírgulas sobrando, vírgula
+# decimal, resposta truncada), a validação de cada competência/critério separadamente e o
+# recálculo da nota final a partir das notas. O que não puder ser aproveitado é listado
+# como seção faltante, para que só essas seções sejam pedidas de novo ao modelo.
+
+# Incrementar ao mudar os modelos: entra na chave do cache de correções
+VERSAO_ESQUEMA = 1
+
+
+class CompetenciaEnem(BaseModel):
+    id: int = Field(ge=1, le=5)
+    nota: int = Field(ge=0, le=200)
+    feedback: str = Field(min_length=1)
+
+
+class CriterioUfsc(BaseModel):
+    id: int = Field(ge=1, le=4)
+    nome: str = ""
+    nota: float = Field(ge=0, le=2.5)
+    feedback: str = Field(min_length=1)
+
+    @field_validator("nota", mode="before")
+    @classmethod
+    def _virgula_decimal(cls, valor):
+        # O prompt descreve as notas como "0,00 a 2,50"
+        return valor.replace(",", ".") if isinstance(valor, str) else valor
+
+
+class RelatorioEnem(BaseModel):
+    nota_final: int
+    analise_geral: str
+    competencias: list[CompetenciaEnem]
+
+
+class RelatorioUfsc(BaseModel):
+    nota_final: float
+    analise_geral: str
+    criterios: list[CriterioUfsc]
+
+
+NOMES_CRITERIOS_UFSC = {
+    1: "Adequação à proposta (tema e gênero)",
+    2: "Emprego da modalidade escrita na variedade padrão",
+    3: "Coerência e coesão",
+    4: "Nível de informatividade e de argumentação ou narratividade",
+}
+
+# tipo -> (chave da lista, modelo do item, ids esperados)
+ESQUEMAS = {
+    "enem": ("competencias", CompetenciaEnem, range(1, 6)),
+    "ufsc": ("criterios", CriterioUfsc, range(1, 5)),
+}
+
+
+class ErroRelatorio(ValueError):
+    """A resposta do modelo não contém nenhum JSON aproveitável."""
+
+
+# --- Reparo de JSON ---
+_CERCA_MARKDOWN = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$", re.IGNORECASE)
+_VIRGULA_SOBRANDO = re.compile(r",\s*([}\]])")
+_NOTA_VIRGULA_DECIMAL = re.compile(r'("nota"\s*:\s*-?\d+),(\d+)')
+
+
+def _fechar_truncado(texto: str) -> str | None:
+    """Corta o texto logo após o último objeto ou lista completo e fecha os que ficaram
+    abertos. Um item pela metade é descartado (e depois pedido de novo), nunca completado
+    com valores inventados."""
+    abertos: list[str] = []
+    em_string = escape = False
+    ultimo_fechamento = None
+    for i, caractere in enumerate(texto):
+        if em_string:
+            if escape:
+                escape = False
+            elif caractere == "\\":
+                escape = True
+            elif caractere == '"':
+                em_string = False
+        elif caractere == '"':
+            em_string = True
+        elif caractere in "{[":
+            abertos.append("}" if caractere == "{" else "]")
+        elif caractere in "}]":
+            if not abertos:
+                break
+            abertos.pop()
+            ultimo_fechamento = (i + 1, list(abertos))
+    if ultimo_fechamento is None:
+        return None
+    fim, pendentes = ultimo_fechamento
+    return re.sub(r",\s*$", "", texto[:fim]) + "".join(reversed(pendentes))
+
+
+def reparar_json(texto: str) -> tuple[dict, bool]:
+    """Interpreta a resposta do modelo como um objeto JSON. Retorna o objeto e se foi
+    preciso repará-lo; lança `ErroRelatorio` se não houver nada aproveitável."""
+    try:
+        dados = json.loads(texto)
+        if isinstance(dados, dict):
+            return dados, False
+    except json.JSONDecodeError:
+        pass
+
+    texto = _CERCA_MARKDOWN.sub("", texto)
+    inicio = texto.find("{")
+    if inicio < 0:
+        raise ErroRelatorio("A resposta do modelo não contém um objeto JSON.")
+    fim = texto.rfind("}")
+    candidatos = [texto[inicio:fim + 1]] if fim > inicio else []
+    candidatos.append(texto[inicio:])
+
+    for candidato in candidatos:
+        candidato = _NOTA_VIRGULA_DECIMAL.sub(r"\1.\2", _VIRGULA_SOBRANDO.sub(r"\1", candidato))
+        for tentativa in (candidato, _fechar_truncado(candidato)):
+            if tentativa is None:
+                continue
+            try:
+                dados = json.loads(tentativa)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(dados, dict):
+                return dados, True
+    raise ErroRelatorio("Não foi possível reparar o JSON retornado pelo modelo.")
+
+
+# --- Validação ---
+def validar(tipo: str, dados: dict) -> tuple[dict, list]:
+    """Valida cada competência/critério separadamente e recalcula a nota final.
+    Retorna o relatório com as seções válidas e a lista das faltantes (ids dos
+    itens ausentes ou inválidos e "analise_geral", se for o caso)."""
+    chave, modelo_item, ids_esperados = ESQUEMAS[tipo]
+    itens = {}
+    for bruto in dados.get(chave) or []:
+        try:
+            item = modelo_item.model_validate(bruto)
+        except ValidationError:
+            continue
+        if item.id not in itens:
+            itens[item.id] = item
+
+    faltantes: list = [id_ for id_ in ids_esperados if id_ not in itens]
+    analise_geral = dados.get("analise_geral")
+    if not isinstance(analise_geral, str) or not analise_geral.strip():
+        analise_geral = ""
+        faltantes.append("analise_geral")
+
+    ordenados = [itens[id_] for id_ in ids_esperados if id_ in itens]
+    if tipo == "ufsc":
+        for item in ordenados:
+            item.nome = item.nome or NOMES_CRITERIOS_UFSC[item.id]
+    nota_final = sum(item.nota for item in ordenados)
+    relatorio = {
+        "nota_final": round(nota_final, 2) if tipo == "ufsc" else nota_final,
+        "analise_geral": analise_geral,
+        chave: [item.model_dump() for item in ordenados],
+    }
+    return relatorio, faltantes
+
+
+def combinar(tipo: str, relatorio: dict, dados: dict) -> tuple[dict, list]:
+    """Acrescenta ao relatório parcial as seções vindas de uma nova resposta e valida de novo."""
+    chave = ESQUEMAS[tipo][0]
+    itens_novos = dados.get(chave)
+    combinado = {
+        "analise_geral": relatorio["analise_geral"] or dados.get("analise_geral"),
+        chave: relatorio[chave] + (itens_novos if isinstance(itens_novos, list) else []),
+    }
+    return validar(tipo, combinado)
+
+
+def instrucao_parcial(tipo: str, faltantes: list) -> str:
+    """Instrução anexada ao prompt original pedindo apenas as seções faltantes, no mesmo
+    formato da estrutura de saída do prompt."""
+    chave = ESQUEMAS[tipo][0]
+    ids = [f for f in faltantes if f != "analise_geral"]
+    campos = []
+    pedido = []
+    if "analise_geral" in faltantes:
+        campos.append('  "analise_geral": "<um parágrafo com o resumo do desempenho do aluno>"')
+    if ids:
+        itens = []
+        for id_ in ids:
+            nome = f' "nome": "{NOMES_CRITERIOS_UFSC[id_]}",' if tipo == "ufsc" else ""
+            itens.append(f'    {{ "id": {id_},{nome} "nota": <nota_c{id_}>, "feedback": "<feedback_c{id_}>" }}')
+        campos.append(f'  "{chave}": [\n' + ",\n".join(itens) + "\n  ]")
+        if tipo == "enem":
+            secao = "as competências" if len(ids) > 1 else "a competência"
+        else:
+            secao = "os critérios" if len(ids) > 1 else "o critério"
+        pedido.append(f"{secao} {', '.join(map(str, ids))}")
+    if "analise_geral" in faltantes:
+        pedido.append("a análise geral")
+    return (
+        "\n\n---\n**Avaliação parcial:** As demais seções desta correção já foram avaliadas. "
+        f"Avalie SOMENTE {' e '.join(pedido)}, seguindo as mesmas instruções, e responda com um "
+        "objeto JSON válido exatamente nesta estrutura, sem nenhum texto fora dela:\n"
+        "{\n" + ",\n".join(campos) + "\n}"
+    )
@@ -0,0 +1,40 @@
+import os
+import json
+import asyncio
+
+# --- Server-Sent Events ---
+# Formatação mínima de eventos SSE usada pelos endpoints de streaming.
+
+SSE_HEARTBEAT_SEGUNDOS = float(os.environ.get("SSE_HEARTBEAT_SEGUNDOS", "15"))
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    # Evita que proxies como o nginx acumulem a resposta antes de repassá-la
+    "X-Accel-Buffering": "no",
+}
+
+
+def formatar_evento(evento: str, dados) -> str:
+    """Serializa `dados` em JSON e monta um evento SSE com o nome informado."""
+    return f"event: {evento}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+
+async def com_heartbeat(eventos, intervalo: float = SSE_HEARTBEAT_SEGUNDOS):
+    """Repassa os eventos e, enquanto nenhum chega (OCR, busca, fila do Gemini), envia
+    comentários SSE periódicos para que proxies não encerrem a conexão ociosa."""
+    iterador = eventos.__aiter__()
+    proximo = asyncio.ensure_future(iterador.__anext__())
+    try:
+        while True:
+            concluidos, _ = await asyncio.wait({proximo}, timeout=intervalo)
+            if not concluidos:
+                yield ": keep-alive\n\n"
+                continue
+            try:
+                evento = proximo.result()
+            except StopAsyncIteration:
+                return
+            yield evento
+            proximo = asyncio.ensure_future(iterador.__anext__())
+    finally:
+        proximo.cancel()
@@ -0,0 +1,134 @@
+import time
+import asyncio
+import threading
+import pytest
+from src import agendador
+from src.agendador import ErroUpstream, FilaUpstream
+
+
+class ErroServico(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+@pytest.fixture(autouse=True)
+def agendador_limpo(monkeypatch):
+    monkeypatch.setattr(agendador, "AGENDADOR_BACKOFF_BASE", 0.0)
+    agendador._filas.clear()
+    agendador._em_voo.clear()
+    yield
+    agendador._filas.clear()
+    agendador._em_voo.clear()
+
+
+def test_fila_libera_por_ordem_de_prioridade():
+    async def cenario():
+        fila = FilaUpstream("teste", requisicoes_por_minuto=60_000, rajada=10, max_concorrencia=1)
+        await fila.adquirir(agendador.PRIORIDADE_INTERATIVA)
+        ordem = []
+
+        async def esperar(prioridade, nome):
+            await fila.adquirir(prioridade)
+            ordem.append(nome)
+            fila.liberar()
+
+        tarefas = [
+            asyncio.create_task(esperar(agendador.PRIORIDADE_INGESTAO, "ingestao")),
+            asyncio.create_task(esperar(agendador.PRIORIDADE_LOTE, "lote")),
+            asyncio.create_task(esperar(agendador.PRIORIDADE_INTERATIVA, "interativa")),
+        ]
+        await asyncio.sleep(0.01)
+        assert ordem == []
+        fila.liberar()
+        await asyncio.gather(*tarefas)
+        return ordem
+
+    assert asyncio.run(cenario()) == ["interativa", "lote", "ingestao"]
+
+
+def test_balde_de_tokens_limita_a_taxa_apos_a_rajada():
+    async def cenario():
+        # 600 por minuto = um token a cada 0,1 s, rajada de 2
+        fila = FilaUpstream("teste", requisicoes_por_minuto=600, rajada=2, max_concorrencia=10)
+        inicio = time.monotonic()
+        for _ in range(3):
+            await fila.adquirir(agendador.PRIORIDADE_INTERATIVA)
+        return time.monotonic() - inicio
+
+    assert asyncio.run(cenario()) >= 0.08
+
+
+def test_chamadas_com_mesma_chave_sao_coalescidas():
+    chamadas = 0
+    lock = threading.Lock()
+
+    def lenta(valor):
+        nonlocal chamadas
+        with lock:
+            chamadas += 1
+        time.sleep(0.05)
+        return valor * 2
+
+    async def cenario():
+        return await asyncio.gather(*(agendador.chamar("gemini", lenta, 21, chave="mesma") for _ in range(5)))
+
+    assert asyncio.run(cenario()) == [42] * 5
+    assert chamadas == 1
+    assert agendador._em_voo == {}
+
+
+def test_erro_temporario_e_repetido_ate_dar_certo():
+    tentativas = []
+
+    def instavel():
+        tentativas.append(1)
+        if len(tentativas) < 3:
+            raise ErroServico(503)
+        return "ok"
+
+    assert asyncio.run(agendador.chamar("gemini", instavel)) == "ok"
+    assert len(tentativas) == 3
+
+
+def test_cota_esgotada_vira_erro_upstream_429_com_retry_after():
+    tentativas = []
+
+    def sem_cota():
+        tentativas.append(1)
+        raise ErroServico(429)
+
+    with pytest.raises(ErroUpstream) as erro:
+        asyncio.run(agendador.chamar("gemini", sem_cota))
+    assert erro.value.status_code == 429
+    assert erro.value.retry_after >= 1
+    assert len(tentativas) == agendador.AGENDADOR_MAX_TENTATIVAS
+
+
+def test_erro_nao_temporario_nao_e_repetido():
+    tentativas = []
+
+    def invalida():
+        tentativas.append(1)
+        raise ValueError("requisição inválida")
+
+    with pytest.raises(ValueError):
+        asyncio.run(agendador.chamar("gemini", invalida))
+    assert len(tentativas) == 1
+
+
+def test_iterar_repete_apenas_antes_do_primeiro_item():
+    tentativas = []
+
+    def stream():
+        tentativas.append(1)
+        if len(tentativas) == 1:
+            raise ErroServico(503)
+        yield "a"
+        yield "b"
+
+    async def cenario():
+        return [item async for item in agendador.iterar("gemini", stream)]
+
+    assert asyncio.run(cenario()) == ["a", "b"]
+    assert len(tentativas) == 2
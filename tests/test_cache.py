@@ -0,0 +1,106 @@
+import sqlite3
+import asyncio
+from types import SimpleNamespace
+import pytest
+from src import cache, metricas
+from src.cache import CacheLRU
+
+
+class Relogio:
+    def __init__(self):
+        self.agora = 1_000.0
+
+    def time(self):
+        return self.agora
+
+    def avancar(self, segundos: float):
+        self.agora += segundos
+
+
+@pytest.fixture(autouse=True)
+def relogio(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr(cache, "time", SimpleNamespace(time=relogio.time))
+    monkeypatch.setattr(metricas, "_caches", [])
+    return relogio
+
+
+def chaves_no_disco(diretorio, nome: str) -> set[str]:
+    with sqlite3.connect(str(diretorio / f"{nome}.sqlite3")) as conexao:
+        return {chave for (chave,) in conexao.execute("SELECT chave FROM cache")}
+
+
+# --- Camada em memória ---
+def test_item_expira_apos_o_ttl(relogio):
+    c = CacheLRU("ttl", ttl_segundos=60)
+    c.set("a", 1)
+    relogio.avancar(59)
+    assert c.get("a") == 1
+    relogio.avancar(2)
+    assert c.get("a") is None
+    assert c.estatisticas() == {"itens_memoria": 0, "hits_memoria": 1, "hits_disco": 0, "misses": 1}
+
+
+def test_lru_descarta_o_menos_usado_recentemente():
+    c = CacheLRU("lru", max_itens=2)
+    c.set("a", 1)
+    c.set("b", 2)
+    assert c.get("a") == 1
+    c.set("c", 3)
+    assert c.get("b") is None
+    assert (c.get("a"), c.get("c")) == (1, 3)
+
+
+# --- Camada em disco ---
+def test_arquivo_so_e_criado_no_primeiro_uso(tmp_path):
+    c = CacheLRU("preguicoso", diretorio_disco=str(tmp_path / "cache"))
+    assert not (tmp_path / "cache").exists()
+    c.set("a", 1)
+    assert (tmp_path / "cache" / "preguicoso.sqlite3").exists()
+
+
+def test_nova_instancia_le_do_disco(tmp_path):
+    CacheLRU("persistente", diretorio_disco=str(tmp_path)).set("a", {"nota": 800})
+    nova = CacheLRU("persistente", diretorio_disco=str(tmp_path))
+    assert nova.get("a") == {"nota": 800}
+    assert nova.get("a") == {"nota": 800}
+    assert nova.estatisticas()["hits_disco"] == 1
+    assert nova.estatisticas()["hits_memoria"] == 1
+
+
+def test_item_expirado_no_disco_nao_e_retornado(tmp_path, relogio):
+    CacheLRU("expira", ttl_segundos=60, diretorio_disco=str(tmp_path)).set("a", 1)
+    relogio.avancar(61)
+    assert CacheLRU("expira", ttl_segundos=60, diretorio_disco=str(tmp_path)).get("a") is None
+
+
+def test_aget_e_aset_usam_o_disco(tmp_path):
+    async def cenario():
+        await CacheLRU("assincrono", diretorio_disco=str(tmp_path)).aset("a", [1, 2])
+        nova = CacheLRU("assincrono", diretorio_disco=str(tmp_path))
+        return await nova.aget("a"), await nova.aget("b")
+
+    assert asyncio.run(cenario()) == ([1, 2], None)
+
+
+def test_poda_remove_os_menos_acessados(tmp_path, relogio):
+    c = CacheLRU("poda", max_itens=1, diretorio_disco=str(tmp_path), max_itens_disco=10)
+    for i in range(10):
+        c.set(f"k{i}", i)
+        relogio.avancar(1)
+    # k0 é lido de novo (do disco) e passa a ser um dos mais recentes
+    assert c.get("k0") == 0
+    relogio.avancar(1)
+    c.set("k10", 10)
+    # Acima do limite, a poda desce a 90% dele descartando os de acesso mais antigo
+    assert chaves_no_disco(tmp_path, "poda") == {"k0"} | {f"k{i}" for i in range(3, 11)}
+
+
+def test_poda_descarta_primeiro_os_expirados(tmp_path, relogio):
+    c = CacheLRU("poda_ttl", max_itens=1, ttl_segundos=5, diretorio_disco=str(tmp_path), max_itens_disco=3)
+    c.set("velho1", 1)
+    c.set("velho2", 2)
+    relogio.avancar(10)
+    c.set("novo1", 3)
+    c.set("novo2", 4)
+    assert chaves_no_disco(tmp_path, "poda_ttl") == {"novo1", "novo2"}
@@ -0,0 +1,62 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from src import lotes, recursos, redacao
+from src.agendador import ErroUpstream
+from src.lotes import LoteStore
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = LoteStore(str(tmp_path / "lotes.sqlite3"))
+    monkeypatch.setitem(recursos._fabricas, "lotes_store", lambda: store)
+    monkeypatch.setitem(recursos._instancias, "lotes_store", store)
+    monkeypatch.setattr(lotes, "_semaforo_workers", None)
+    return store
+
+
+def corretor(monkeypatch, *respostas):
+    """Substitui a correção por respostas roteirizadas (exceções são lançadas)."""
+    chamadas = []
+
+    async def corrigir(tipo, texto, genero=None, prioridade=0):
+        chamadas.append(texto)
+        resposta = respostas[len(chamadas) - 1]
+        if isinstance(resposta, Exception):
+            raise resposta
+        return resposta
+
+    monkeypatch.setattr(redacao, "corrigir_redacao", corrigir)
+    return chamadas
+
+
+def test_item_sem_cota_continua_pendente_e_e_tentado_de_novo(store, monkeypatch):
+    lote_id = store.criar("enem", None, [{"nome": "texto-1", "texto": "Redação."}])
+    status_entre_tentativas = []
+
+    async def sem_cota(tipo, texto, genero=None, prioridade=0):
+        status_entre_tentativas.append(store.obter(lote_id)["itens"][0]["status"])
+        if len(status_entre_tentativas) == 1:
+            raise ErroUpstream("gemini", 429, 0, "Cota esgotada.")
+        return {"nota_final": 800}
+
+    monkeypatch.setattr(redacao, "corrigir_redacao", sem_cota)
+    asyncio.run(lotes.processar_lote(lote_id, "enem", None))
+
+    assert status_entre_tentativas == ["pendente", "pendente"]
+    lote = store.obter(lote_id)
+    assert lote["status"] == "concluido"
+    assert lote["itens"][0]["status"] == "concluido"
+    assert lote["itens"][0]["resultado"] == {"nota_final": 800}
+
+
+def test_falha_nao_temporaria_marca_o_item_com_erro(store, monkeypatch):
+    lote_id = store.criar("enem", None, [{"nome": "texto-1", "texto": "A"}, {"nome": "texto-2", "texto": "B"}])
+    chamadas = corretor(monkeypatch, HTTPException(status_code=502, detail="Correção incompleta."), {"nota_final": 600})
+    asyncio.run(lotes.processar_lote(lote_id, "enem", None))
+
+    assert len(chamadas) == 2
+    itens = {item["nome"]: item for item in store.obter(lote_id)["itens"]}
+    falhou, corrigido = (itens["texto-1"], itens["texto-2"]) if chamadas[0] == "A" else (itens["texto-2"], itens["texto-1"])
+    assert falhou["status"] == "erro" and falhou["erro"] == "Correção incompleta."
+    assert corrigido["status"] == "concluido"
@@ -0,0 +1,118 @@
+import io
+import json
+import asyncio
+import pytest
+from src import metricas
+
+
+@pytest.fixture
+def saida_traces(monkeypatch):
+    monkeypatch.setattr(metricas, "METRICAS_TRACE_LOGS", True)
+    monkeypatch.setattr(metricas.logger, "propagate", metricas.logger.propagate)
+    monkeypatch.setattr(metricas.logger, "level", metricas.logger.level)
+    saida = io.StringIO()
+    handler = metricas.configurar_log_traces(saida)
+    yield saida
+    metricas.logger.removeHandler(handler)
+
+
+async def app_com_etapa(scope, receive, send):
+    with metricas.etapa("teste", "processamento"):
+        pass
+    await send({"type": "http.response.start", "status": 201, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def requisitar(app, caminho="/itens"):
+    enviadas = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(mensagem):
+        enviadas.append(mensagem)
+
+    scope = {"type": "http", "method": "POST", "path": caminho}
+    asyncio.run(metricas.MiddlewareMetricas(app)(scope, receive, send))
+    return enviadas
+
+
+def test_trace_da_requisicao_e_escrito_em_log(saida_traces):
+    requisitar(app_com_etapa)
+    linhas = saida_traces.getvalue().splitlines()
+    assert len(linhas) == 1
+    trace = json.loads(linhas[0])
+    assert trace["metodo"] == "POST"
+    assert trace["status"] == 201
+    assert trace["rota"] == "desconhecida"
+    assert [e["etapa"] for e in trace["etapas"]] == ["processamento"]
+
+
+def test_sem_a_opcao_nenhum_handler_e_instalado(monkeypatch):
+    monkeypatch.setattr(metricas, "METRICAS_TRACE_LOGS", False)
+    assert metricas.configurar_log_traces(io.StringIO()) is None
+
+
+def test_contadores_exportam_o_valor_completo():
+    contador = metricas.Contador("teste_grande_total", "Contador de teste.")
+    contador.inc(12_345_678)
+    assert "cognita_teste_grande_total 12345678" in contador.exportar()
+    metricas._metricas.remove(contador)
+
+
+def erros_da_etapa(nome):
+    return sum(valor for chave, valor in metricas.ETAPA_ERROS._valores.items() if chave[:2] == ("teste", nome))
+
+
+def test_cronometrar_mede_so_a_espera_pelos_itens():
+    async def itens():
+        for item in "abc":
+            await asyncio.sleep(0.01)
+            yield item
+
+    async def cenario():
+        recebidos = []
+        async for item in metricas.cronometrar("teste", "espera", itens()):
+            recebidos.append(item)
+            await asyncio.sleep(0.05)
+        return recebidos
+
+    assert asyncio.run(cenario()) == ["a", "b", "c"]
+    _, soma, total = metricas.ETAPA_DURACAO._series[("teste", "espera")]
+    assert total == 1
+    assert 0.03 <= soma < 0.12
+
+
+def test_cliente_que_desconecta_nao_conta_como_erro():
+    encerrado = []
+
+    async def itens():
+        try:
+            while True:
+                yield "token"
+        finally:
+            encerrado.append(True)
+
+    async def cenario():
+        gerador = metricas.cronometrar("teste", "desconexao", itens())
+        await gerador.__anext__()
+        await gerador.aclose()
+
+    asyncio.run(cenario())
+    assert encerrado == [True]
+    assert erros_da_etapa("desconexao") == 0
+    assert metricas.ETAPA_DURACAO._series[("teste", "desconexao")][2] == 1
+
+
+def test_erro_do_servico_conta_como_erro_da_etapa():
+    async def itens():
+        yield "a"
+        raise RuntimeError("falhou")
+
+    async def cenario():
+        async for _ in metricas.cronometrar("teste", "falha", itens()):
+            pass
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(cenario())
+    assert erros_da_etapa("falha") == 1
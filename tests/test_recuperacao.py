@@ -0,0 +1,127 @@
+import pytest
+from src.recuperacao import IndiceBM25, fundir_rrf, montar_contexto, tokenizar, _remover_sobreposicao
+
+
+def frase(inicio: int, palavras: int = 80) -> str:
+    """Texto sem repetições, para que trechos diferentes nunca pareçam duplicados."""
+    return " ".join(f"palavra{i}" for i in range(inicio, inicio + palavras))
+
+
+def chunk(chunk_id: str, conteudo: str, source: str = "doc.pdf") -> dict:
+    return {"id": chunk_id, "source": source, "conteudo": conteudo}
+
+
+def ids(itens: list[dict]) -> list[str]:
+    return [item["id"] for item in itens]
+
+
+# --- Tokenização ---
+def test_tokenizar_remove_acentos_e_stopwords_e_mantem_siglas():
+    assert tokenizar("A fotossíntese e o ATP não são da célula? Nº 2") == ["fotossintese", "atp", "celula", "2"]
+
+
+# --- Fusão por RRF ---
+def test_rrf_prioriza_itens_presentes_nos_dois_rankings():
+    densa = [chunk("a", "A"), chunk("b", "B"), chunk("c", "C")]
+    lexica = [chunk("c", "C"), chunk("d", "D")]
+    assert ids(fundir_rrf([densa, lexica])) == ["c", "a", "b", "d"]
+
+
+def test_rrf_nao_repete_itens():
+    ranking = [chunk("a", "A"), chunk("b", "B")]
+    assert ids(fundir_rrf([ranking, ranking])) == ["a", "b"]
+
+
+# --- Sobreposição entre chunks vizinhos ---
+def test_remove_inicio_que_repete_o_final_do_anterior():
+    anterior = frase(0, 20)
+    repetido = frase(15, 5)
+    assert _remover_sobreposicao(f"{repetido} continua o texto", anterior) == "continua o texto"
+
+
+def test_remove_final_que_repete_o_inicio_do_anterior():
+    anterior = frase(0, 20)
+    repetido = frase(0, 5)
+    assert _remover_sobreposicao(f"texto anterior ao chunk {repetido}", anterior) == "texto anterior ao chunk"
+
+
+def test_sobreposicao_curta_e_mantida():
+    assert _remover_sobreposicao("fim. Novo trecho", "Um texto qualquer no fim.") == "fim. Novo trecho"
+
+
+# --- Montagem do contexto ---
+def test_contexto_respeita_o_orcamento_de_tokens():
+    # Cada chunk tem perto de 200 tokens (~4 caracteres por token)
+    candidatos = [chunk(str(i), frase(i * 100)) for i in range(5)]
+    selecionados = montar_contexto(candidatos, orcamento_tokens=450)
+    assert ids(selecionados) == ["0", "1"]
+
+
+def test_primeiro_candidato_entra_mesmo_acima_do_orcamento():
+    assert ids(montar_contexto([chunk("grande", frase(0, 500))], orcamento_tokens=10)) == ["grande"]
+
+
+def test_candidato_menor_ainda_cabe_depois_de_um_que_nao_coube():
+    candidatos = [chunk("a", frase(0)), chunk("grande", frase(1000, 300)), chunk("b", frase(2000, 10))]
+    assert ids(montar_contexto(candidatos, orcamento_tokens=300)) == ["a", "b"]
+
+
+def test_quase_duplicatas_sao_descartadas():
+    original = frase(0)
+    candidatos = [chunk("a", original), chunk("copia", original + " palavra_extra", source="outro.pdf"), chunk("b", frase(500))]
+    assert ids(montar_contexto(candidatos, orcamento_tokens=10_000)) == ["a", "b"]
+
+
+def test_sobreposicao_com_chunk_do_mesmo_documento_e_cortada():
+    anterior = frase(0, 40)
+    seguinte = frase(35, 40)  # começa repetindo as 5 últimas palavras do anterior
+    selecionados = montar_contexto([chunk("a", anterior), chunk("b", seguinte)], orcamento_tokens=10_000)
+    assert selecionados[1]["conteudo"] == frase(40, 35)
+
+
+# --- Índice BM25 ---
+@pytest.fixture
+def indice(tmp_path):
+    return IndiceBM25(str(tmp_path / "bm25.sqlite3"))
+
+
+def test_bm25_encontra_termo_exato(indice):
+    indice.adicionar(
+        ["1", "2", "3"],
+        ["A mitocôndria produz ATP.", "O cloroplasto faz fotossíntese.", "O núcleo guarda o DNA."],
+        ["bio.pdf"] * 3,
+    )
+    assert ids(indice.buscar("fotossíntese", k=3)) == ["2"]
+    assert indice.buscar("fotossintese", k=3)[0]["conteudo"] == "O cloroplasto faz fotossíntese."
+
+
+def test_bm25_filtra_por_documento(indice):
+    indice.adicionar(["a", "b"], ["Ciclo de Krebs na célula.", "Ciclo de Krebs resumido."], ["aula1.pdf", "aula2.pdf"])
+    resultado = indice.buscar("krebs", k=5, sources=["aula2.pdf"])
+    assert ids(resultado) == ["b"]
+    assert resultado[0]["source"] == "aula2.pdf"
+
+
+def test_bm25_com_filtro_usa_o_df_da_colecao_inteira(indice):
+    # "fotossintese" aparece em quase toda a coleção (idf baixo) e "rubisco" em um único
+    # chunk (idf alto). Com o df calculado só sobre o documento filtrado, os dois termos
+    # teriam o mesmo peso e o chunk com mais repetições de "fotossintese" passaria à frente.
+    textos = [f"fotossintese {frase(i * 10, 8)}" for i in range(8)]
+    indice.adicionar([f"a{i}" for i in range(8)], textos, ["a.pdf"] * 8)
+    indice.adicionar(
+        ["b1", "b2"],
+        [f"rubisco {frase(200, 9)}", f"fotossintese fotossintese {frase(300, 8)}"],
+        ["b.pdf"] * 2,
+    )
+    sem_filtro = [i for i in ids(indice.buscar("fotossintese rubisco", k=10)) if i.startswith("b")]
+    com_filtro = ids(indice.buscar("fotossintese rubisco", k=10, sources=["b.pdf"]))
+    assert com_filtro == sem_filtro == ["b1", "b2"]
+
+
+def test_bm25_readicionar_substitui_o_chunk(indice):
+    indice.adicionar(["1"], ["texto sobre genética"], ["bio.pdf"])
+    indice.adicionar(["1"], ["texto sobre ecologia"], ["bio.pdf"])
+    assert indice.contar() == 1
+    assert indice.buscar("genética", k=1) == []
+    indice.remover(["1"])
+    assert indice.buscar("ecologia", k=1) == []
@@ -0,0 +1,55 @@
+import threading
+import pytest
+from src import recursos
+
+
+@pytest.fixture(autouse=True)
+def registro_limpo(monkeypatch):
+    monkeypatch.setattr(recursos, "_fabricas", {})
+    monkeypatch.setattr(recursos, "_instancias", {})
+    monkeypatch.setattr(recursos, "_locks", {})
+
+
+def test_recurso_e_construido_uma_unica_vez():
+    construcoes = []
+    recursos.registrar("cliente", lambda: construcoes.append(1) or object())
+    threads = [threading.Thread(target=recursos.obter, args=("cliente",)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(construcoes) == 1
+
+
+def test_recurso_lento_nao_bloqueia_os_demais():
+    liberar = threading.Event()
+    recursos.registrar("lento", lambda: liberar.wait(5) and "lento")
+    recursos.registrar("rapido", lambda: "rapido")
+    construcao = threading.Thread(target=recursos.obter, args=("lento",))
+    construcao.start()
+    try:
+        resultado = []
+        outra = threading.Thread(target=lambda: resultado.append(recursos.obter("rapido")))
+        outra.start()
+        outra.join(1)
+        assert resultado == ["rapido"]
+    finally:
+        liberar.set()
+        construcao.join()
+    assert recursos.obter("lento") == "lento"
+
+
+def test_fabrica_pode_obter_outro_recurso():
+    recursos.registrar("llm", lambda: "llm")
+    recursos.registrar("cadeia", lambda: ("cadeia", recursos.obter("llm")))
+    assert recursos.obter("cadeia") == ("cadeia", "llm")
+
+
+def test_aquecer_retorna_as_falhas():
+    def falhar():
+        raise RuntimeError("sem credenciais")
+
+    recursos.registrar("ok", lambda: 1)
+    recursos.registrar("quebrado", falhar)
+    assert recursos.aquecer() == {"quebrado": "sem credenciais"}
+    assert "quebrado" not in recursos._instancias
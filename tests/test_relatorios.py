@@ -0,0 +1,158 @@
+import json
+import asyncio
+from types import SimpleNamespace
+import pytest
+from fastapi import HTTPException
+from src import relatorios, recursos, redacao
+from src.relatorios import ErroRelatorio, reparar_json, validar, combinar, instrucao_parcial
+
+
+def competencias(*ids, nota=160):
+    return [{"id": i, "nota": nota, "feedback": f"Feedback {i}."} for i in ids]
+
+
+def relatorio_enem(*ids, **extra):
+    return {"nota_final": 999, "analise_geral": "Boa redação.", "competencias": competencias(*ids), **extra}
+
+
+# --- Reparo de JSON ---
+def test_json_valido_nao_e_marcado_como_reparado():
+    dados = relatorio_enem(1, 2, 3, 4, 5)
+    assert reparar_json(json.dumps(dados)) == (dados, False)
+
+
+def test_remove_cercas_de_markdown_e_texto_em_volta():
+    texto = "Segue a correção:\n```json\n" + json.dumps(relatorio_enem(1)) + "\n```\n"
+    assert reparar_json(texto) == (relatorio_enem(1), True)
+
+
+def test_remove_virgulas_sobrando():
+    dados, reparado = reparar_json('{"analise_geral": "ok", "competencias": [{"id": 1, "nota": 40, "feedback": "f"},],}')
+    assert reparado
+    assert dados["competencias"] == [{"id": 1, "nota": 40, "feedback": "f"}]
+
+
+def test_converte_virgula_decimal_nas_notas():
+    dados, _ = reparar_json('{"criterios": [{"id": 1, "nota": 2,25, "feedback": "f"}]}')
+    assert dados["criterios"][0]["nota"] == 2.25
+
+
+def test_virgula_fora_das_notas_nao_e_alterada():
+    dados, _ = reparar_json('{"analise_geral": "notas 1,5 e 2,0", "criterios": [],}')
+    assert dados["analise_geral"] == "notas 1,5 e 2,0"
+
+
+def test_resposta_truncada_mantem_apenas_itens_completos():
+    completo = json.dumps(relatorio_enem(1, 2, 3, 4, 5))
+    truncado = completo[:completo.index('{"id": 4') + len('{"id": 4, "nota": 1')]
+    dados, reparado = reparar_json(truncado)
+    assert reparado
+    # O item 4 (pela metade) é descartado, nunca completado com uma nota inventada
+    assert [c["id"] for c in dados["competencias"]] == [1, 2, 3]
+
+
+def test_truncamento_dentro_de_string_com_chaves():
+    truncado = '{"analise_geral": "ok", "competencias": [{"id": 1, "nota": 80, "feedback": "usa {chaves}"}, {"id": 2, "feedback": "corta }'
+    dados, _ = reparar_json(truncado)
+    assert dados["competencias"] == [{"id": 1, "nota": 80, "feedback": "usa {chaves}"}]
+
+
+def test_sem_json_aproveitavel_lanca_erro():
+    with pytest.raises(ErroRelatorio):
+        reparar_json("Desculpe, não consigo corrigir esta redação.")
+
+
+# --- Validação ---
+def test_nota_final_e_recalculada_pela_soma():
+    relatorio, faltantes = validar("enem", relatorio_enem(1, 2, 3, 4, 5))
+    assert faltantes == []
+    assert relatorio["nota_final"] == 800
+
+
+def test_itens_invalidos_ou_ausentes_sao_faltantes():
+    dados = relatorio_enem(1, 2)
+    dados["competencias"] += [
+        {"id": 3, "nota": 240, "feedback": "acima do máximo"},
+        {"id": 4, "nota": 120, "feedback": ""},
+        {"id": 9, "nota": 120, "feedback": "id inexistente"},
+        {"id": 1, "nota": 0, "feedback": "duplicado"},
+    ]
+    relatorio, faltantes = validar("enem", dados)
+    assert faltantes == [3, 4, 5]
+    assert [c["id"] for c in relatorio["competencias"]] == [1, 2]
+    assert relatorio["competencias"][0]["nota"] == 160
+    assert relatorio["nota_final"] == 320
+
+
+def test_analise_geral_vazia_e_faltante():
+    _, faltantes = validar("enem", relatorio_enem(1, 2, 3, 4, 5, analise_geral="  "))
+    assert faltantes == ["analise_geral"]
+
+
+def test_ufsc_aceita_nota_com_virgula_e_preenche_nomes():
+    dados = {
+        "analise_geral": "ok",
+        "criterios": [{"id": i, "nota": "2,25" if i == 1 else 1.5, "feedback": "f"} for i in range(1, 5)],
+    }
+    relatorio, faltantes = validar("ufsc", dados)
+    assert faltantes == []
+    assert relatorio["nota_final"] == 6.75
+    assert relatorio["criterios"][2]["nome"] == relatorios.NOMES_CRITERIOS_UFSC[3]
+
+
+def test_combinar_acrescenta_apenas_as_secoes_faltantes():
+    relatorio, faltantes = validar("enem", relatorio_enem(1, 2, 3, analise_geral=""))
+    assert faltantes == [4, 5, "analise_geral"]
+    novos = {"analise_geral": "Agora completa.", "competencias": competencias(4, 5, nota=200) + competencias(1, nota=0)}
+    combinado, faltantes = combinar("enem", relatorio, novos)
+    assert faltantes == []
+    assert combinado["analise_geral"] == "Agora completa."
+    # A competência 1 já avaliada não é substituída pela repetida na nova resposta
+    assert [c["nota"] for c in combinado["competencias"]] == [160, 160, 160, 200, 200]
+    assert combinado["nota_final"] == 880
+
+
+def test_instrucao_parcial_pede_somente_as_faltantes():
+    instrucao = instrucao_parcial("ufsc", [3, "analise_geral"])
+    assert "o critério 3 e a análise geral" in instrucao
+    assert '"id": 3' in instrucao and '"id": 1' not in instrucao
+    assert relatorios.NOMES_CRITERIOS_UFSC[3] in instrucao
+
+
+# --- Fluxo com nova tentativa parcial ---
+class GeminiRoteirizado:
+    def __init__(self, *respostas):
+        self.respostas = list(respostas)
+        self.prompts = []
+
+    def generate_content(self, prompt, stream=False):
+        self.prompts.append(prompt)
+        return SimpleNamespace(text=self.respostas.pop(0))
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    def instalar(*respostas):
+        falso = GeminiRoteirizado(*respostas)
+        monkeypatch.setitem(recursos._fabricas, "gemini_correcao", lambda: falso)
+        monkeypatch.setitem(recursos._instancias, "gemini_correcao", falso)
+        return falso
+    return instalar
+
+
+def test_secoes_faltantes_sao_pedidas_de_novo_sem_regerar_tudo(gemini):
+    falso = gemini(json.dumps({"competencias": competencias(4, 5, nota=200)}))
+    resposta = json.dumps(relatorio_enem(1, 2, 3))
+    relatorio = asyncio.run(redacao.validar_correcao("enem", resposta, "Texto da redação."))
+    assert relatorio["nota_final"] == 880
+    assert len(falso.prompts) == 1
+    assert "as competências 4, 5" in falso.prompts[0]
+
+
+def test_falha_apos_tentativas_parciais_vira_502(gemini, monkeypatch):
+    monkeypatch.setattr(redacao, "CORRECAO_TENTATIVAS_PARCIAIS", 1)
+    falso = gemini("Sem JSON.")
+    with pytest.raises(HTTPException) as erro:
+        asyncio.run(redacao.validar_correcao("enem", "Também sem JSON.", "Texto."))
+    assert erro.value.status_code == 502
+    assert len(falso.prompts) == 1